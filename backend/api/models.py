@@ -19,10 +19,14 @@ class AnalysisStatus(str, Enum):
 class AnalysisConfig(BaseModel):
     """分析の設定"""
     model: Optional[str] = "gpt-3.5-turbo"
-    extraction_limit: Optional[int] = 1000
+    extraction_limit: Optional[int] = None  # 抽出するコメント数の上限（None の場合は制限しない）
     extraction_workers: Optional[int] = 3
+    extraction_routing: Optional[bool] = True
     num_clusters: Optional[int] = 8
+    clustering_mode: Optional[str] = "auto"  # "auto" / "standard" / "large"
     label_sample_size: Optional[int] = 20
+    label_sample_seed: Optional[int] = 42
+    label_mode: Optional[str] = "joint"
     takeaway_sample_size: Optional[int] = 50
     languages: Optional[List[str]] = []
     custom_prompt: Optional[str] = None
@@ -47,6 +51,8 @@ class ProjectResponse(BaseModel):
     progress: Optional[int] = 0
     current_step: Optional[str] = ""
     error_message: Optional[str] = None
+    translation_status: Optional[str] = None  # 翻訳の追加: "pending" / "running" / "completed" / "failed"
+    share_url: Optional[str] = None  # 共有用の静的バンドルの manifest のURL
 
 class CommentData(BaseModel):
     """コメントデータ"""
@@ -61,9 +67,21 @@ class ExtractedArgument(BaseModel):
     """抽出された議論"""
     argument_id: str
     comment_id: str
-    argument: str
-    summary: str
+    argument: str = Field(..., description="コメントから抽出された、具体的で明確な議論や意見")
+    summary: str = Field(..., description="議論の短い要約（20文字以内）")
     cluster_id: Optional[int] = None
+    agree: Optional[int] = None
+    disagree: Optional[int] = None
+
+class ClusterStats(BaseModel):
+    """クラスターごとの賛否の集計"""
+    comments: int
+    agree: int
+    disagree: int
+    votes: int
+    consensus: Optional[float] = None
+    polarization: Optional[float] = None
+    top_arguments: List[str] = []
 
 class ClusterData(BaseModel):
     """クラスターデータ"""
@@ -74,6 +92,17 @@ class ClusterData(BaseModel):
     size: int
     x: float
     y: float
+    stats: Optional[ClusterStats] = None
+
+class ClusterSummary(BaseModel):
+    """議論を含まないクラスターの概要"""
+    cluster_id: int
+    label: str
+    summary: str
+    size: int
+    x: float
+    y: float
+    stats: ClusterStats
 
 class ReportData(BaseModel):
     """レポートデータ"""
@@ -87,3 +116,23 @@ class ReportData(BaseModel):
     translations: Optional[Dict[str, Dict[str, str]]] = None
     metadata: Dict[str, Any]
     generated_at: datetime
+
+class SearchHit(BaseModel):
+    """検索結果の議論"""
+    argument_id: str
+    comment_id: str
+    argument: str
+    summary: str
+    cluster_id: Optional[int] = None
+    score: float
+
+class SearchResponse(BaseModel):
+    """検索結果"""
+    project_id: str
+    query: str
+    total: int
+    results: List[SearchHit]
+
+class TranslationRequest(BaseModel):
+    """翻訳追加のリクエスト"""
+    languages: List[str] = Field(..., min_length=1, description="追加する言語コード（例: en, zh, ko）")
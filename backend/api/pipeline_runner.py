@@ -1,20 +1,20 @@
 import os
 import json
+import uuid
 import asyncio
 from datetime import datetime
-from typing import Dict, Any, List
-import pandas as pd
+from functools import cached_property
+from typing import Dict, Any, List, Optional
 import numpy as np
-from sklearn.manifold import TSNE
-import umap
 import logging
 
-from pipeline.extraction import ArgumentExtractor
-from pipeline.clustering import ArgumentClusterer
-from pipeline.labeling import ClusterLabeler
-from pipeline.visualization import VisualizationGenerator
+from pipeline.storage import ProjectArrays
+from pipeline.llm_utils import ParseStats
 from config import settings
 
+# pandas / sklearn / umap / openai を読み込むパイプラインの各段階は、
+# APIの起動を遅くしないよう初回の分析時に読み込む
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -44,14 +44,82 @@ def convert_numpy_types(obj):
     else:
         return obj
 
+class AnalysisRun:
+    """1回の分析の実行状態
+
+    分析ごとに作成し、設定・進捗・LLM応答の集計・抽出経路の記録など、
+    実行中に変化する状態はすべてここに持たせる（PipelineRunner と各段階は共有される）。
+    """
+    
+    def __init__(self, project_id: str, config: Dict[str, Any], projects_db: Dict[str, Any]):
+        self.project_id = project_id
+        self.run_id = f"{project_id}:{uuid.uuid4().hex[:8]}"
+        self.config = config
+        self.projects_db = projects_db
+        self.output_dir = os.path.join(settings.OUTPUT_DIR, project_id)
+        self.model = config.get("model", settings.OPENAI_MODEL)
+        # LLM応答の解析失敗・修復の集計と、コメントごとの抽出経路
+        self.parse_stats = ParseStats()
+        self.routing_log: List[Dict[str, Any]] = []
+    
+    @property
+    def project(self) -> Dict[str, Any]:
+        return self.projects_db[self.project_id]
+    
+    def update_progress(self, step: str, progress: int):
+        """進捗を更新"""
+        self.project["current_step"] = step
+        self.project["progress"] = progress
+
 class PipelineRunner:
     """パイプライン実行クラス"""
     
     def __init__(self):
-        self.extractor = ArgumentExtractor()
-        self.clusterer = ArgumentClusterer()
-        self.labeler = ClusterLabeler()
-        self.visualizer = VisualizationGenerator()
+        # result.json の読み書きをプロジェクトごとに直列化するロック（イベントループごとに作り直す）
+        self._result_locks: Dict[str, asyncio.Lock] = {}
+        self._locks_loop = None
+    
+    def _result_lock(self, project_id: str) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._locks_loop is not loop:
+            self._result_locks = {}
+            self._locks_loop = loop
+        return self._result_locks.setdefault(project_id, asyncio.Lock())
+    
+    @cached_property
+    def extractor(self):
+        from pipeline.extraction import ArgumentExtractor
+        return ArgumentExtractor()
+    
+    @cached_property
+    def clusterer(self):
+        from pipeline.clustering import ArgumentClusterer
+        return ArgumentClusterer()
+    
+    @cached_property
+    def labeler(self):
+        from pipeline.labeling import ClusterLabeler
+        return ClusterLabeler()
+    
+    @cached_property
+    def takeaway_generator(self):
+        from pipeline.takeaways import TakeawayGenerator
+        return TakeawayGenerator()
+    
+    @cached_property
+    def translator(self):
+        from pipeline.translation import ReportTranslator
+        return ReportTranslator()
+    
+    @cached_property
+    def visualizer(self):
+        from pipeline.visualization import VisualizationGenerator
+        return VisualizationGenerator()
+    
+    @cached_property
+    def publisher(self):
+        from pipeline.publish import ReportPublisher
+        return ReportPublisher(settings.PUBLIC_DIR, settings.PUBLIC_URL_PREFIX)
     
     async def run_analysis(
         self,
@@ -60,102 +128,19 @@ class PipelineRunner:
         config: Dict[str, Any],
         projects_db: Dict[str, Any]
     ):
-        """分析を実行"""
+        """分析を実行
+
+        実行ごとの状態は AnalysisRun に持たせ、各段階のインスタンスは状態を持たないため、
+        複数のプロジェクトを同時に分析できる。LLMの同時リクエスト数は実行中の分析で
+        等分され（llm_budget）、クラスタリングは cpu_slots の数までしか同時に実行しない。
+        """
+        from pipeline.concurrency import llm_budget
+        
+        run = AnalysisRun(project_id, config, projects_db)
         try:
-            logger.info(f"Starting analysis for project {project_id}")
-            output_dir = os.path.join(settings.OUTPUT_DIR, project_id)
-            os.makedirs(output_dir, exist_ok=True)
-            
-            # 進捗を更新する関数
-            def update_progress(step: str, progress: int):
-                projects_db[project_id]["current_step"] = step
-                projects_db[project_id]["progress"] = progress
-            
-            # 1. CSVファイルを読み込み
-            update_progress("CSVファイルを読み込み中...", 10)
-            df = pd.read_csv(csv_path)
-            
-            # 必須カラムの確認
-            required_columns = ['comment-id', 'comment-body']
-            missing_columns = [col for col in required_columns if col not in df.columns]
-            if missing_columns:
-                raise ValueError(f"必須カラムが不足しています: {missing_columns}")
-            
-            # コメント数の制限
-            if len(df) > settings.MAX_COMMENTS_PER_ANALYSIS:
-                logger.warning(f"コメント数が制限を超えています。最初の{settings.MAX_COMMENTS_PER_ANALYSIS}件のみ処理します。")
-                df = df.head(settings.MAX_COMMENTS_PER_ANALYSIS)
-            
-            # 2. 議論を抽出
-            update_progress("議論を抽出中...", 30)
-            extracted_args = await self.extractor.extract_arguments(
-                df,
-                question=projects_db[project_id]["question"],
-                model=config.get("model", settings.OPENAI_MODEL),
-                limit=config.get("extraction_limit", 1000),
-                workers=config.get("extraction_workers", settings.EXTRACTION_WORKERS)
-            )
-            
-            # 抽出結果を保存
-            args_df = pd.DataFrame(extracted_args)
-            # NumPy型を標準のPython型に変換
-            args_df = args_df.astype(object).where(pd.notnull(args_df), None)
-            args_df.to_csv(os.path.join(output_dir, "args.csv"), index=False)
-            
-            # 3. クラスタリング
-            update_progress("クラスタリング中...", 50)
-            clusters, embeddings = await self.clusterer.cluster_arguments(
-                extracted_args,
-                num_clusters=config.get("num_clusters", settings.DEFAULT_CLUSTERS)
-            )
-            
-            # 4. ラベル生成
-            update_progress("ラベルを生成中...", 70)
-            labeled_clusters = await self.labeler.generate_labels(
-                clusters,
-                model=config.get("model", settings.OPENAI_MODEL),
-                sample_size=config.get("label_sample_size", settings.LABEL_SAMPLE_SIZE)
-            )
-            
-            # 5. 可視化データの生成
-            update_progress("可視化データを生成中...", 85)
-            visualization_data = await self.visualizer.generate_visualization(
-                labeled_clusters,
-                embeddings,
-                args_df
-            )
-            
-            # 6. 結果を保存
-            update_progress("結果を保存中...", 95)
-            result = {
-                "project_id": project_id,
-                "project_name": projects_db[project_id]["name"],
-                "question": projects_db[project_id]["question"],
-                "total_comments": len(df),
-                "total_arguments": len(extracted_args),
-                "clusters": visualization_data["clusters"],
-                "takeaways": visualization_data.get("takeaways", []),
-                "metadata": {
-                    "created_at": datetime.now().isoformat(),
-                    "config": config,
-                    "version": "0.1.0"
-                }
-            }
-            
-            # NumPy型を標準のPython型に変換
-            result = convert_numpy_types(result)
-            
-            # 結果をJSONファイルとして保存
-            result_path = os.path.join(output_dir, "result.json")
-            with open(result_path, "w", encoding="utf-8") as f:
-                json.dump(result, f, ensure_ascii=False, indent=2, cls=NumpyEncoder)
-            
-            # ステータスを更新
-            projects_db[project_id]["status"] = "completed"
-            projects_db[project_id]["analysis_status"] = "completed"
-            projects_db[project_id]["progress"] = 100
-            projects_db[project_id]["current_step"] = "完了"
-            
+            logger.info(f"Starting analysis for project {project_id} (run {run.run_id})")
+            async with llm_budget.run(run.run_id):
+                await self._execute(run, csv_path)
             logger.info(f"Analysis completed for project {project_id}")
             
         except Exception as e:
@@ -164,3 +149,265 @@ class PipelineRunner:
             projects_db[project_id]["analysis_status"] = "failed"
             projects_db[project_id]["error_message"] = str(e)
             raise
+    
+    async def _execute(self, run: AnalysisRun, csv_path: str):
+        """分析の各段階を実行"""
+        import pandas as pd
+        from pipeline.stats import compute_cluster_stats
+        from pipeline.routing import summarize_routing
+        
+        project_id = run.project_id
+        config = run.config
+        output_dir = run.output_dir
+        update_progress = run.update_progress
+        os.makedirs(output_dir, exist_ok=True)
+        
+        # 1. CSVファイルを読み込み
+        update_progress("CSVファイルを読み込み中...", 10)
+        df = pd.read_csv(csv_path)
+        
+        # 必須カラムの確認
+        required_columns = ['comment-id', 'comment-body']
+        missing_columns = [col for col in required_columns if col not in df.columns]
+        if missing_columns:
+            raise ValueError(f"必須カラムが不足しています: {missing_columns}")
+        
+        # コメント数の制限（大規模モードはメモリ使用量が件数によらないため制限しない）
+        clustering_mode = config.get("clustering_mode") or "auto"
+        if clustering_mode == "standard" and len(df) > settings.MAX_COMMENTS_PER_ANALYSIS:
+            logger.warning(f"コメント数が制限を超えています。最初の{settings.MAX_COMMENTS_PER_ANALYSIS}件のみ処理します。")
+            df = df.head(settings.MAX_COMMENTS_PER_ANALYSIS)
+        
+        # 2. 議論を抽出
+        update_progress("議論を抽出中...", 30)
+        extracted_args = await self.extractor.extract_arguments(
+            df,
+            question=run.project["question"],
+            model=run.model,
+            limit=config.get("extraction_limit"),
+            workers=config.get("extraction_workers", settings.EXTRACTION_WORKERS),
+            parse_stats=run.parse_stats,
+            routing=config.get("extraction_routing", settings.EXTRACTION_ROUTING),
+            routing_log=run.routing_log
+        )
+        
+        # コメントごとの抽出経路を保存
+        pd.DataFrame(
+            run.routing_log,
+            columns=["comment_id", "route", "model", "max_tokens", "reason", "chars", "arguments"]
+        ).to_csv(os.path.join(output_dir, "routing.csv"), index=False)
+        
+        args_df = pd.DataFrame(extracted_args)
+        # NumPy型を標準のPython型に変換
+        args_df = args_df.astype(object).where(pd.notnull(args_df), None)
+        
+        # 3. クラスタリング
+        update_progress("クラスタリング中...", 50)
+        # 埋め込み・座標・クラスター割り当てはメモリマップ配列として保存される
+        # （以降の処理やAPIからは mmap_mode='r' で共有して読み込む）
+        project_arrays = ProjectArrays(output_dir)
+        await self.clusterer.cluster_arguments(
+            extracted_args,
+            project_arrays,
+            num_clusters=config.get("num_clusters", settings.DEFAULT_CLUSTERS),
+            large={"auto": None, "standard": False, "large": True}.get(clustering_mode)
+        )
+        labels = project_arrays.labels
+        coords = project_arrays.coords
+        
+        # 抽出結果をクラスター割り当て・座標付きで保存
+        args_df.assign(
+            cluster_id=np.asarray(labels),
+            x=np.asarray(coords[:, 0]),
+            y=np.asarray(coords[:, 1])
+        ).to_csv(os.path.join(output_dir, "args.csv"), index=False)
+        
+        # 4. ラベル生成
+        update_progress("ラベルを生成中...", 70)
+        labeled_clusters = await self.labeler.generate_labels(
+            args_df,
+            labels,
+            coords,
+            project_arrays.embeddings,
+            model=run.model,
+            sample_size=config.get("label_sample_size", settings.LABEL_SAMPLE_SIZE),
+            seed=config.get("label_sample_seed", settings.LABEL_SAMPLE_SEED),
+            mode=config.get("label_mode", settings.LABEL_MODE),
+            parse_stats=run.parse_stats
+        )
+        
+        # クラスターごとの賛否の集計
+        cluster_stats = compute_cluster_stats(args_df, labels)
+        
+        # 5. 要点の生成（クラスターの要約を段階的にまとめる）
+        update_progress("要点を生成中...", 80)
+        takeaways = await self.takeaway_generator.generate_takeaways(
+            labeled_clusters,
+            question=run.project["question"],
+            model=run.model,
+            fan_in=config.get("takeaway_sample_size", settings.TAKEAWAY_SAMPLE_SIZE),
+            token_budget=settings.TAKEAWAY_TOKEN_BUDGET,
+            max_takeaways=settings.MAX_TAKEAWAYS
+        )
+        
+        # 6. 可視化データの生成
+        update_progress("可視化データを生成中...", 85)
+        visualization_data = await self.visualizer.generate_visualization(
+            labeled_clusters,
+            args_df,
+            labels,
+            coords,
+            takeaways,
+            cluster_stats
+        )
+        
+        # 7. 結果を保存
+        update_progress("結果を保存中...", 95)
+        result = {
+            "project_id": project_id,
+            "project_name": run.project["name"],
+            "question": run.project["question"],
+            "total_comments": len(df),
+            "total_arguments": len(extracted_args),
+            "clusters": visualization_data["clusters"],
+            "takeaways": visualization_data.get("takeaways", []),
+            "metadata": {
+                "created_at": datetime.now().isoformat(),
+                "config": config,
+                "parse_stats": run.parse_stats.as_dict(),
+                "routing": summarize_routing(run.routing_log),
+                "version": "0.1.0"
+            }
+        }
+        
+        # NumPy型を標準のPython型に変換
+        result = convert_numpy_types(result)
+        
+        # 翻訳（設定されている言語のみ）
+        languages = config.get("languages") or []
+        if languages:
+            update_progress("翻訳中...", 97)
+            result["translations"] = await self.translator.translate_report(
+                result,
+                languages,
+                model=run.model,
+                parse_stats=run.parse_stats
+            )
+            result["metadata"]["parse_stats"] = run.parse_stats.as_dict()
+        
+        # 結果をJSONファイルとして保存
+        async with self._result_lock(project_id):
+            self._save_result(output_dir, result)
+        
+        # クラスターの集計のみを別ファイルに保存（議論を含まない軽量版）
+        stats_path = os.path.join(output_dir, "stats.json")
+        with open(stats_path, "w", encoding="utf-8") as f:
+            json.dump(
+                [{k: v for k, v in c.items() if k != "arguments"} for c in result["clusters"]],
+                f,
+                ensure_ascii=False,
+                cls=NumpyEncoder
+            )
+        
+        # 検索用の索引と散布図用の多重解像度ピラミッドを構築
+        # （CPUを使うため、イベントループを止めないよう別スレッドで実行）
+        await asyncio.to_thread(self._build_indexes, output_dir, args_df['argument'].tolist())
+        
+        # 共有用の静的バンドルを書き出す（公開レポートの閲覧はAPIを経由しない）
+        if settings.PUBLISH_ON_COMPLETE:
+            await self._publish_after_run(project_id, run.project)
+        
+        # ステータスを更新
+        run.project["status"] = "completed"
+        run.project["analysis_status"] = "completed"
+        run.project["progress"] = 100
+        run.project["current_step"] = "完了"
+    
+    def _build_indexes(self, output_dir: str, texts: List[str]):
+        """検索用の索引と散布図用のピラミッドを構築（クラスタリングの埋め込み・座標を再利用）"""
+        from pipeline.search import ProjectSearchIndex
+        from pipeline.lod import PointPyramid
+        
+        ProjectSearchIndex.build(output_dir, texts, brute_force_limit=settings.SEARCH_BRUTE_FORCE_LIMIT)
+        PointPyramid.build(output_dir, max_level=settings.LOD_MAX_LEVEL)
+    
+    async def publish(self, project_id: str, project: Dict[str, Any]) -> Dict[str, Any]:
+        """共有用の静的バンドルを書き出す（result.json が変わっていなければ既存のものを使う）"""
+        output_dir = os.path.join(settings.OUTPUT_DIR, project_id)
+        latest = await asyncio.to_thread(self.publisher.publish, project_id, output_dir)
+        project["share_url"] = latest["manifest"]
+        return latest
+    
+    async def _publish_after_run(self, project_id: str, project: Dict[str, Any]) -> None:
+        """分析・翻訳の完了時の書き出し（失敗しても分析自体は失敗にしない）
+
+        失敗した場合は share_url を更新せず、POST /api/projects/{project_id}/publish で
+        後から書き出せるようにする。
+        """
+        try:
+            await self.publish(project_id, project)
+        except Exception as e:
+            logger.error(f"Error publishing share bundle for project {project_id}: {e}", exc_info=True)
+    
+    def _save_result(self, output_dir: str, result: Dict[str, Any]):
+        """結果をJSONファイルとして保存"""
+        result_path = os.path.join(output_dir, "result.json")
+        tmp_path = result_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2, cls=NumpyEncoder)
+        os.replace(tmp_path, result_path)
+    
+    async def add_translations(
+        self,
+        project_id: str,
+        languages: List[str],
+        config: Dict[str, Any],
+        project: Optional[Dict[str, Any]] = None
+    ):
+        """既存のレポートに翻訳を追加（未翻訳の文字列のみAPIを呼び出す）
+
+        翻訳は result.json を読んだ時点の内容に対して行い、保存時はロックを取ってから
+        読み直して翻訳表をマージするため、同じプロジェクトへの翻訳の追加が同時に
+        実行されても互いの結果を上書きしない。project を渡した場合は進行状況
+        （translation_status / error_message）を記録し、共有用のバンドルを書き出し直す。
+        """
+        output_dir = os.path.join(settings.OUTPUT_DIR, project_id)
+        result_path = os.path.join(output_dir, "result.json")
+        if project is not None:
+            project["translation_status"] = "running"
+            project["error_message"] = None
+        
+        try:
+            with open(result_path, "r", encoding="utf-8") as f:
+                report = json.load(f)
+            
+            from pipeline.concurrency import llm_budget
+            
+            parse_stats = ParseStats()
+            async with llm_budget.run(f"{project_id}:{uuid.uuid4().hex[:8]}"):
+                translations = await self.translator.translate_report(
+                    report,
+                    languages,
+                    model=config.get("model", settings.OPENAI_MODEL),
+                    parse_stats=parse_stats
+                )
+            
+            async with self._result_lock(project_id):
+                with open(result_path, "r", encoding="utf-8") as f:
+                    result = json.load(f)
+                result.setdefault("translations", {}).update(translations)
+                result.setdefault("metadata", {}).setdefault("parse_stats", {}).update(parse_stats.as_dict())
+                self._save_result(output_dir, result)
+        except Exception as e:
+            logger.error(f"Error adding translations {languages} for project {project_id}: {e}")
+            if project is not None:
+                project["translation_status"] = "failed"
+                project["error_message"] = f"翻訳に失敗しました: {e}"
+            raise
+        
+        if project is not None:
+            project["translation_status"] = "completed"
+            if settings.PUBLISH_ON_COMPLETE:
+                await self._publish_after_run(project_id, project)
+        
+        logger.info(f"Added translations {languages} for project {project_id}")
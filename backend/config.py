@@ -10,21 +10,69 @@ class Settings(BaseSettings):
     # OpenAI設定
     OPENAI_API_KEY: str
     OPENAI_MODEL: str = "gpt-3.5-turbo"
+    STRUCTURED_OUTPUT: str = "tools"  # "tools"（関数呼び出し）、"json"（JSONモード）、"off"
     
     # ファイルパス
     UPLOAD_DIR: str = "data/uploads"
     OUTPUT_DIR: str = "data/outputs"
     LOG_DIR: str = "logs"
+    CACHE_DIR: str = "data/cache"  # LLM応答などの永続キャッシュ
+    NUMBA_CACHE_DIR: str = "data/numba_cache"  # numba（UMAP）のコンパイル済みカーネルのキャッシュ
+    
+    # 起動設定
+    WARMUP_ON_STARTUP: bool = True  # 起動時にバックグラウンドで数値計算ライブラリを読み込み、JITコンパイルを済ませる
     
     # 制限
     MAX_UPLOAD_SIZE: int = 10 * 1024 * 1024  # 10MB
-    MAX_COMMENTS_PER_ANALYSIS: int = 5000
+    MAX_COMMENTS_PER_ANALYSIS: int = 5000  # clustering_mode="standard" の場合のみ適用
     
     # Pipeline設定
     EXTRACTION_WORKERS: int = 3
+    EXTRACTION_ROUTING: bool = True  # コメントの長さ・内容に応じてモデルと出力トークン数を切り替える
+    EXTRACTION_STRONG_MODEL: str = ""  # 長い・複雑なコメントに使うモデル（空の場合は切り替えず、プロジェクトのモデルを使う）
+    EXTRACTION_LOCAL_MAX_CHARS: int = 20  # この文字数以下の1文のコメントはLLMを使わずにそのまま議論とする
+    EXTRACTION_STRONG_MIN_CHARS: int = 400  # この文字数以上のコメントは EXTRACTION_STRONG_MODEL で抽出
+    EXTRACTION_STRONG_MIN_SENTENCES: int = 8  # この文（箇条書き）数以上のコメントも同様
+    EXTRACTION_MAX_TOKENS: int = 1500  # 抽出1件あたりの出力トークン数の上限
+    
+    # 同時実行の設定（複数のプロジェクトを同時に分析する場合）
+    LLM_MAX_CONCURRENCY: int = 16  # プロセス全体のLLM同時リクエスト数（実行中の分析で等分する）
+    CLUSTERING_SLOTS: int = 1  # 同時に実行するクラスタリングの数（numba の workqueue 層では常に1に制限される）
+    
+    # 大規模モード（議論数が多い場合のクラスタリング）
+    LARGE_SCALE_THRESHOLD: int = 5000  # clustering_mode="auto" でこの議論数を超えると大規模モードにする
+    LARGE_SCALE_SAMPLE_SIZE: int = 5000  # TF-IDF・UMAPの学習に使う標本の数
+    LARGE_SCALE_CHUNK_SIZE: int = 5000  # 一度に変換・学習する議論の数（メモリ使用量の上限を決める）
+    LARGE_SCALE_EPOCHS: int = 3  # MiniBatchKMeans で全チャンクを学習する回数
     DEFAULT_CLUSTERS: int = 8
     LABEL_SAMPLE_SIZE: int = 20
-    TAKEAWAY_SAMPLE_SIZE: int = 50
+    LABEL_SAMPLE_SEED: int = 42
+    LABEL_MODE: str = "joint"  # "joint"（一括）または "individual"（クラスターごと）
+    LABEL_JOINT_DIGEST_SIZE: int = 5  # 一括ラベリングで各クラスターから送る代表的な議論の数
+    LABEL_JOINT_TOKEN_BUDGET: int = 3000  # 一括ラベリング1リクエストあたりの入力トークン予算
+    TAKEAWAY_SAMPLE_SIZE: int = 50  # 要点生成で1回のまとめ処理に含めるクラスター要約の最大数
+    TAKEAWAY_TOKEN_BUDGET: int = 3000  # 要点生成1リクエストあたりの入力トークン予算
+    MAX_TAKEAWAYS: int = 5
+    
+    # 翻訳設定
+    TRANSLATION_TOKEN_BUDGET: int = 2000  # 翻訳1リクエストあたりの入力トークン予算
+    TRANSLATION_BATCH_SIZE: int = 100  # 翻訳1リクエストあたりの最大文字列数
+    
+    # 検索設定
+    SEARCH_BRUTE_FORCE_LIMIT: int = 20000  # これを超える議論数ではIVF索引を使う
+    SEARCH_DEFAULT_LIMIT: int = 20
+    
+    # 散布図の詳細度（LOD）設定
+    LOD_MAX_LEVEL: int = 8  # 最も細かいレベル（各軸 2^8 セル）
+    LOD_MAX_ITEMS: int = 5000  # 1レスポンスで返す点・ビンの最大数
+    
+    # エクスポート設定
+    EXPORT_CHUNK_SIZE: int = 5000  # 一度に読み込んで変換する行数（メモリ使用量の上限を決める）
+    
+    # 共有用の静的バンドル設定（nginx から直接配信する）
+    PUBLIC_DIR: str = "data/public"  # バンドルの書き出し先（nginx の /share/ にマウントする）
+    PUBLIC_URL_PREFIX: str = "/share"  # バンドルを配信するURLのパス
+    PUBLISH_ON_COMPLETE: bool = True  # 分析・翻訳の完了時にバンドルを書き出す
     
     class Config:
         env_file = ".env"
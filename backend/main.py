@@ -1,6 +1,6 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
+from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Query, Path
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from contextlib import asynccontextmanager
 import os
 import shutil
@@ -8,19 +8,24 @@ from datetime import datetime
 from typing import Optional, List
 import json
 import uuid
+import asyncio
 
 from api.models import (
     ProjectCreate,
     ProjectResponse,
     ProjectStatus,
     AnalysisStatus,
-    AnalysisConfig
+    AnalysisConfig,
+    SearchResponse,
+    TranslationRequest,
+    ClusterSummary
 )
 from api.pipeline_runner import PipelineRunner
+from pipeline.warmup import configure_numba, warm_up_in_background
 from config import settings
 
 # Create necessary directories
-for dir_path in [settings.UPLOAD_DIR, settings.OUTPUT_DIR, settings.LOG_DIR]:
+for dir_path in [settings.UPLOAD_DIR, settings.OUTPUT_DIR, settings.LOG_DIR, settings.CACHE_DIR, settings.PUBLIC_DIR]:
     os.makedirs(dir_path, exist_ok=True)
 
 @asynccontextmanager
@@ -29,6 +34,13 @@ async def lifespan(app: FastAPI):
     print(f"Starting TttC MVP API...")
     print(f"Upload directory: {settings.UPLOAD_DIR}")
     print(f"Output directory: {settings.OUTPUT_DIR}")
+    
+    # numba のJITコンパイル（UMAP）をバックグラウンドで済ませておく
+    # （起動は待たずに完了し、最初の分析から通常の速度で実行できる。
+    #   クラスタリングとは cpu_slots を共有し、同時には実行しない）
+    configure_numba()
+    if settings.WARMUP_ON_STARTUP:
+        app.state.warmup = asyncio.create_task(warm_up_in_background())
     yield
     # Shutdown
     print("Shutting down...")
@@ -52,6 +64,13 @@ app.add_middleware(
 # In-memory storage for demo (本番環境ではデータベースを使用)
 projects_db = {}
 pipeline_runner = PipelineRunner()
+search_indexes = {}
+point_pyramids = {}
+
+def evict_project_caches(project_id: str):
+    """プロジェクトの読み込み済みデータを破棄（再分析・削除時）"""
+    search_indexes.pop(project_id, None)
+    point_pyramids.pop(project_id, None)
 
 @app.get("/")
 async def root():
@@ -128,6 +147,7 @@ async def start_analysis(
     
     # バックグラウンドで分析を実行
     project["analysis_status"] = AnalysisStatus.RUNNING
+    evict_project_caches(project_id)
     background_tasks.add_task(
         pipeline_runner.run_analysis,
         project_id,
@@ -164,12 +184,14 @@ async def get_analysis_status(project_id: str):
         "status": project["status"],
         "analysis_status": project["analysis_status"],
         "progress": project.get("progress", 0),
-        "current_step": project.get("current_step", "")
+        "current_step": project.get("current_step", ""),
+        "translation_status": project.get("translation_status"),
+        "error_message": project.get("error_message")
     }
 
 @app.get("/api/projects/{project_id}/report")
-async def get_report(project_id: str):
-    """生成されたレポートデータを取得"""
+async def get_report(project_id: str, locale: Optional[str] = None):
+    """生成されたレポートデータを取得（locale を指定すると翻訳版を返す）"""
     if project_id not in projects_db:
         raise HTTPException(status_code=404, detail="Project not found")
     
@@ -187,8 +209,212 @@ async def get_report(project_id: str):
     with open(report_path, "r", encoding="utf-8") as f:
         report_data = json.load(f)
     
+    if locale:
+        from pipeline.translation import localize_report
+        translations = (report_data.get("translations") or {}).get(locale)
+        if translations is None:
+            raise HTTPException(status_code=404, detail=f"Translation not available: {locale}")
+        return localize_report(report_data, translations)
+    
     return report_data
 
+@app.get("/api/projects/{project_id}/points")
+async def get_points(
+    project_id: str,
+    bbox: Optional[str] = Query(None, description="表示範囲 xmin,ymin,xmax,ymax"),
+    zoom: int = Query(0, ge=0)
+):
+    """散布図の点を表示範囲とズームレベルに応じて取得（ズームアウト時は集約したビン）"""
+    if project_id not in projects_db:
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    if projects_db[project_id]["analysis_status"] != AnalysisStatus.COMPLETED:
+        raise HTTPException(status_code=400, detail="Analysis not completed yet")
+    
+    bounds = None
+    if bbox:
+        try:
+            bounds = tuple(float(v) for v in bbox.split(","))
+        except ValueError:
+            bounds = ()
+        if len(bounds) != 4 or bounds[0] > bounds[2] or bounds[1] > bounds[3]:
+            raise HTTPException(status_code=400, detail="bbox must be xmin,ymin,xmax,ymax")
+    
+    if project_id not in point_pyramids:
+        from pipeline.lod import PointPyramid
+        output_dir = os.path.join(settings.OUTPUT_DIR, project_id)
+        try:
+            point_pyramids[project_id] = PointPyramid.load(output_dir)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Point data not found")
+    
+    return point_pyramids[project_id].query(bounds, zoom, max_items=settings.LOD_MAX_ITEMS)
+
+@app.get("/api/projects/{project_id}/stats", response_model=List[ClusterSummary])
+async def get_cluster_stats(
+    project_id: str,
+    sort: str = Query("votes", pattern="^(votes|agree|disagree|consensus|polarization|comments|size)$"),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    min_votes: int = Query(0, ge=0)
+):
+    """クラスターごとの賛否の集計を取得（並べ替え・絞り込み可能）"""
+    if project_id not in projects_db:
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    if projects_db[project_id]["analysis_status"] != AnalysisStatus.COMPLETED:
+        raise HTTPException(status_code=400, detail="Analysis not completed yet")
+    
+    stats_path = os.path.join(settings.OUTPUT_DIR, project_id, "stats.json")
+    
+    if not os.path.exists(stats_path):
+        raise HTTPException(status_code=404, detail="Stats not found")
+    
+    with open(stats_path, "r", encoding="utf-8") as f:
+        clusters = json.load(f)
+    
+    from pipeline.stats import sort_cluster_stats
+    return sort_cluster_stats(clusters, sort=sort, descending=(order == "desc"), min_votes=min_votes)
+
+@app.post("/api/projects/{project_id}/translations")
+async def add_translations(
+    project_id: str,
+    request: TranslationRequest,
+    background_tasks: BackgroundTasks
+):
+    """既存のレポートに翻訳を追加"""
+    if project_id not in projects_db:
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    project = projects_db[project_id]
+    
+    if project["analysis_status"] != AnalysisStatus.COMPLETED:
+        raise HTTPException(status_code=400, detail="Analysis not completed yet")
+    
+    languages = list(dict.fromkeys(request.languages))
+    project["config"]["languages"] = list(dict.fromkeys((project["config"].get("languages") or []) + languages))
+    
+    project["translation_status"] = "pending"
+    
+    background_tasks.add_task(
+        pipeline_runner.add_translations,
+        project_id,
+        languages,
+        project["config"],
+        project
+    )
+    
+    return {"message": "Translation started", "project_id": project_id, "languages": languages}
+
+def get_search_index(project_id: str):
+    """検索用の索引を取得（初回のみディスクから読み込む）"""
+    from pipeline.search import ProjectSearchIndex
+    
+    if project_id not in projects_db:
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    if projects_db[project_id]["analysis_status"] != AnalysisStatus.COMPLETED:
+        raise HTTPException(status_code=400, detail="Analysis not completed yet")
+    
+    if project_id not in search_indexes:
+        output_dir = os.path.join(settings.OUTPUT_DIR, project_id)
+        try:
+            search_indexes[project_id] = ProjectSearchIndex.load(output_dir)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Search index not found")
+    
+    return search_indexes[project_id]
+
+@app.get("/api/projects/{project_id}/search", response_model=SearchResponse)
+async def search_arguments(
+    project_id: str,
+    q: str = Query(..., min_length=1),
+    limit: int = Query(settings.SEARCH_DEFAULT_LIMIT, ge=1, le=200),
+    expand: bool = False
+):
+    """キーワードで議論を検索"""
+    index = get_search_index(project_id)
+    results = index.search(q, k=limit, expand=expand)
+    
+    return SearchResponse(project_id=project_id, query=q, total=len(results), results=results)
+
+@app.get("/api/projects/{project_id}/arguments/{argument_id}/similar", response_model=SearchResponse)
+async def similar_arguments(
+    project_id: str,
+    argument_id: str,
+    limit: int = Query(10, ge=1, le=200)
+):
+    """指定した議論に類似した議論を取得"""
+    index = get_search_index(project_id)
+    results = index.similar(argument_id, k=limit)
+    
+    if results is None:
+        raise HTTPException(status_code=404, detail="Argument not found")
+    
+    return SearchResponse(project_id=project_id, query=argument_id, total=len(results), results=results)
+
+@app.get("/api/projects/{project_id}/export/{table}")
+async def export_table(
+    project_id: str,
+    table: str = Path(..., pattern="^(arguments|clusters)$"),
+    format: str = Query("csv", pattern="^(csv|xlsx|parquet)$"),
+    columns: Optional[str] = Query(None, description="出力する列（カンマ区切り）"),
+    clusters: Optional[List[int]] = Query(None, description="出力するクラスターID（複数指定可）")
+):
+    """議論テーブル（クラスター割り当て・座標付き）またはクラスターの集計をダウンロード
+
+    議論テーブルはチャンク単位で変換しながら送信するため、行数によらずメモリ使用量は一定。
+    """
+    if project_id not in projects_db:
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    if projects_db[project_id]["analysis_status"] != AnalysisStatus.COMPLETED:
+        raise HTTPException(status_code=400, detail="Analysis not completed yet")
+    
+    from pipeline.export import ProjectExporter, ARGUMENT_COLUMNS, CLUSTER_COLUMNS, EXPORT_FORMATS
+    
+    available = ARGUMENT_COLUMNS if table == "arguments" else CLUSTER_COLUMNS
+    selected = [c.strip() for c in columns.split(",") if c.strip()] if columns else available
+    unknown = [c for c in selected if c not in available]
+    if unknown or not selected:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown columns: {', '.join(unknown)} (available: {', '.join(available)})"
+        )
+    
+    output_dir = os.path.join(settings.OUTPUT_DIR, project_id)
+    if not os.path.exists(os.path.join(output_dir, "stats.json")):
+        raise HTTPException(status_code=404, detail="Analysis data not found")
+    
+    exporter = ProjectExporter(output_dir, chunk_size=settings.EXPORT_CHUNK_SIZE)
+    if table == "arguments":
+        chunks = exporter.argument_chunks(selected, clusters)
+    else:
+        chunks = [exporter.cluster_table(selected, clusters)]
+    
+    extension, media_type = EXPORT_FORMATS[format]
+    return StreamingResponse(
+        exporter.stream(chunks, selected, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{project_id}_{table}.{extension}"'}
+    )
+
+@app.post("/api/projects/{project_id}/publish")
+async def publish_report(project_id: str):
+    """共有用の静的バンドルを書き出す（レポートが変わっていなければ既存のバンドルを返す）"""
+    if project_id not in projects_db:
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    project = projects_db[project_id]
+    
+    if project["analysis_status"] != AnalysisStatus.COMPLETED:
+        raise HTTPException(status_code=400, detail="Analysis not completed yet")
+    
+    if not os.path.exists(os.path.join(settings.OUTPUT_DIR, project_id, "result.json")):
+        raise HTTPException(status_code=404, detail="Report not found")
+    
+    latest = await pipeline_runner.publish(project_id, project)
+    return {"project_id": project_id, **latest}
+
 @app.delete("/api/projects/{project_id}")
 async def delete_project(project_id: str):
     """プロジェクトを削除"""
@@ -205,7 +431,10 @@ async def delete_project(project_id: str):
     if os.path.exists(output_dir):
         shutil.rmtree(output_dir)
     
+    pipeline_runner.publisher.remove(project_id)
+    
     del projects_db[project_id]
+    evict_project_caches(project_id)
     
     return {"message": "Project deleted successfully"}
 
@@ -0,0 +1,56 @@
+import os
+import json
+import hashlib
+import logging
+import tempfile
+from typing import Any, Optional
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class JsonCache:
+    """ファイルベースの永続キャッシュ
+
+    1エントリ = 1ファイルで保存し、書き込みはアトミックに置き換えるため、
+    複数のプロジェクトやワーカープロセスから同時に使っても壊れない。
+    LLMの応答など、再実行時に再利用したい結果を保存するのに使う。
+    """
+
+    def __init__(self, namespace: str, cache_dir: Optional[str] = None):
+        self.directory = os.path.join(cache_dir or settings.CACHE_DIR, namespace)
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """キーの元になる値からハッシュキーを生成"""
+        payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Any]:
+        """キャッシュを取得（存在しない場合は None）"""
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Ignoring unreadable cache entry {key}: {e}")
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        """キャッシュを保存"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write cache entry {key}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
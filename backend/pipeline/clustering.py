@@ -1,19 +1,57 @@
+import asyncio
 import numpy as np
-from typing import List, Dict, Any, Tuple
-from sklearn.cluster import KMeans
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics import silhouette_score
-import umap
+from typing import List, Dict, Any, Optional
 import logging
 
+from config import settings
+from pipeline.concurrency import cpu_slots
+from pipeline.storage import ProjectArrays
+from pipeline.warmup import configure_numba
+
+# sklearn / umap は読み込みに時間がかかる（umap は numba も読み込む）ため、
+# APIの起動を遅くしないよう使用時に読み込む
+
 logger = logging.getLogger(__name__)
 
+
+def group_by_cluster(labels: np.ndarray, order: Optional[np.ndarray] = None) -> Dict[int, np.ndarray]:
+    """クラスターごとの行番号を取得（空のクラスターは含めない）
+
+    Args:
+        labels: 各行のクラスターID
+        order: 並び替え済みの行番号（省略時はクラスターID順の安定ソート）
+    """
+    labels = np.asarray(labels)
+    if order is None:
+        order = np.argsort(labels, kind="stable")
+    counts = np.bincount(labels)
+    groups = np.split(order, np.cumsum(counts)[:-1])
+    return {int(cid): groups[cid] for cid in np.flatnonzero(counts)}
+
+
+def compute_centroids(labels: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """クラスターごとの重心を計算（行番号 = クラスターID、空のクラスターは0）"""
+    labels = np.asarray(labels)
+    points = np.asarray(points, dtype=np.float64)
+    counts = np.bincount(labels)
+    sums = np.zeros((len(counts), points.shape[1]))
+    np.add.at(sums, labels, points)
+    return sums / np.maximum(counts, 1)[:, None]
+
+
 class ArgumentClusterer:
-    """議論をクラスタリングするクラス"""
+    """議論をクラスタリングするクラス
+
+    インスタンスは状態を持たず、複数のプロジェクトから同時に使える
+    （ベクトル化器などは呼び出しごとに作成する）。
+    """
     
-    def __init__(self):
+    def _build_vectorizer(self):
+        """TF-IDFのベクトル化器を作成（fit_transform で状態が変わるため呼び出しごとに作る）"""
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        
         # 日本語テキスト用に設定を調整
-        self.vectorizer = TfidfVectorizer(
+        return TfidfVectorizer(
             max_features=1500,  # 特徴量を増やす
             ngram_range=(1, 3),  # 3-gramまで考慮
             min_df=1,  # 最小出現文書数を1に変更
@@ -24,6 +62,9 @@ class ArgumentClusterer:
     
     def find_optimal_clusters(self, embeddings: np.ndarray, min_clusters: int = 4, max_clusters: int = 12) -> int:
         """シルエットスコアを使って最適なクラスター数を探す"""
+        from sklearn.cluster import KMeans
+        from sklearn.metrics import silhouette_score
+        
         if len(embeddings) < max_clusters:
             return min(min_clusters, len(embeddings) // 2)
         
@@ -45,13 +86,43 @@ class ArgumentClusterer:
     async def cluster_arguments(
         self,
         arguments: List[Dict[str, Any]],
-        num_clusters: int = 8
-    ) -> Tuple[Dict[int, List[Dict[str, Any]]], np.ndarray]:
-        """議論をクラスタリング"""
-        logger.info(f"Clustering {len(arguments)} arguments into {num_clusters} clusters")
-        
+        store: ProjectArrays,
+        num_clusters: int = 8,
+        large: Optional[bool] = None
+    ) -> Dict[str, np.ndarray]:
+        """議論をクラスタリングし、結果を store にメモリマップ配列として保存
+
+        CPUを占有するため、イベントループを止めないよう別スレッドで実行し、
+        同時に実行するクラスタリングの数は settings.CLUSTERING_SLOTS までに制限する。
+
+        Args:
+            large: True の場合は大規模モード（_cluster_large）で実行する。
+                None の場合は議論数が settings.LARGE_SCALE_THRESHOLD を超えると大規模モードにする
+
+        Returns:
+            {"embeddings", "coords", "labels"} の読み取り専用配列（行は arguments と同じ順序）
+        """
         # テキストデータを抽出
         texts = [arg['argument'] for arg in arguments]
+        if large is None:
+            large = len(texts) > settings.LARGE_SCALE_THRESHOLD
+        
+        async with cpu_slots.slot():
+            if large:
+                return await asyncio.to_thread(self._cluster_large, texts, num_clusters, store)
+            arrays = await asyncio.to_thread(self._cluster_texts, texts, num_clusters)
+            return {name: store.save(name, array) for name, array in arrays.items()}
+    
+    def _cluster_texts(self, texts: List[str], num_clusters: int) -> Dict[str, np.ndarray]:
+        """クラスタリングの本体（同期処理）"""
+        # 別スレッドから numba を使うため、読み込み前にスレッド層を設定する（API起動時に設定済みなら何もしない）
+        configure_numba()
+        import umap
+        from sklearn.cluster import KMeans
+        
+        logger.info(f"Clustering {len(texts)} arguments into {num_clusters} clusters")
+        # フォールバック用の乱数（呼び出しごとに独立させ、結果を再現可能にする）
+        rng = np.random.default_rng(42)
         
         # 十分なデータがない場合の処理
         if len(texts) < num_clusters:
@@ -60,13 +131,13 @@ class ArgumentClusterer:
         
         try:
             # TF-IDFベクトル化
-            tfidf_matrix = self.vectorizer.fit_transform(texts)
+            tfidf_matrix = self._build_vectorizer().fit_transform(texts)
             
             # ベクトルが空の場合の処理
             if tfidf_matrix.shape[1] == 0:
                 logger.error("No features extracted from texts")
                 # フォールバック: 単純なランダムベクトルを使用
-                embeddings = np.random.rand(len(texts), 50)
+                embeddings = rng.random((len(texts), 50))
             else:
                 # 次元削減（UMAP）
                 n_neighbors = min(15, len(texts) - 1)
@@ -83,7 +154,7 @@ class ArgumentClusterer:
         except Exception as e:
             logger.error(f"Error in vectorization: {e}")
             # フォールバック: ランダムベクトルを使用
-            embeddings = np.random.rand(len(texts), 50)
+            embeddings = rng.random((len(texts), 50))
         
         # 2D投影用の座標を先に生成
         try:
@@ -99,7 +170,7 @@ class ArgumentClusterer:
         except Exception as e:
             logger.error(f"Error in 2D projection: {e}")
             # フォールバック: ランダム座標を使用
-            coords_2d = np.random.rand(len(texts), 2) * 10 - 5
+            coords_2d = rng.random((len(texts), 2)) * 10 - 5
         
         # K-meansクラスタリング
         kmeans = KMeans(
@@ -111,18 +182,124 @@ class ArgumentClusterer:
         
         cluster_labels = kmeans.fit_predict(embeddings)
         
-        # クラスタごとに議論を整理（座標も含める）
-        clusters = {}
-        for i, label in enumerate(cluster_labels):
-            if label not in clusters:
-                clusters[label] = []
-            
-            arg = arguments[i].copy()
-            arg['cluster_id'] = int(label)
-            arg['x'] = float(coords_2d[i, 0])
-            arg['y'] = float(coords_2d[i, 1])
-            clusters[label].append(arg)
+        logger.info(f"Created {len(np.unique(cluster_labels))} clusters")
         
-        logger.info(f"Created {len(clusters)} clusters")
+        return {
+            "embeddings": np.asarray(embeddings, dtype=np.float32),
+            "coords": np.asarray(coords_2d, dtype=np.float32),
+            "labels": np.asarray(cluster_labels, dtype=np.int32)
+        }
+    
+    def _cluster_large(self, texts: List[str], num_clusters: int, store: ProjectArrays) -> Dict[str, np.ndarray]:
+        """大規模モードのクラスタリング（クラスタリングのメモリ使用量が議論数によらない）
+
+        1. 無作為に選んだ標本（settings.LARGE_SCALE_SAMPLE_SIZE 件）でTF-IDFとUMAPを学習
+        2. 全件をチャンク（settings.LARGE_SCALE_CHUNK_SIZE 件）ごとに変換し、メモリマップ配列に書き込む
+        3. MiniBatchKMeans の partial_fit でチャンクを順に学習し、チャンクごとに割り当てる
+
+        疎行列の密行列化やUMAPの近傍グラフは標本とチャンクの分だけで済むため、
+        議論数が増えてもクラスタリングに必要なメモリは一定で、ディスク上の配列だけが大きくなる。
+
+        ディスクに逃がしているのはクラスタリングのみで、抽出した議論（extracted_args・args_df）、
+        result.json の組み立て、検索インデックスの構築は従来どおりメモリ上で行う。
+        そのため分析全体のメモリ使用量は議論数に比例して増える（2万件 → 6万件で
+        RSS 943MB → 1056MB 程度）。
+        """
+        configure_numba()
+        import umap
+        from sklearn.cluster import MiniBatchKMeans
+        
+        n = len(texts)
+        chunk_size = settings.LARGE_SCALE_CHUNK_SIZE
+        rng = np.random.default_rng(42)
+        sample = np.sort(rng.choice(n, size=min(n, settings.LARGE_SCALE_SAMPLE_SIZE), replace=False))
+        chunks = [(start, min(start + chunk_size, n)) for start in range(0, n, chunk_size)]
+        
+        # 十分なデータがない場合の処理（_cluster_texts と同じ）
+        if n < num_clusters:
+            num_clusters = min(n, max(2, n // 2))
+            logger.warning(f"Adjusting number of clusters to {num_clusters} due to limited data")
         
-        return clusters, embeddings
+        logger.info(
+            f"Clustering {n} arguments into {num_clusters} clusters "
+            f"(large-scale mode: sample {len(sample)}, {len(chunks)} chunks)"
+        )
+        
+        # 1. 標本で学習（失敗した場合は _cluster_texts と同じくランダムなベクトル・座標を使う）
+        n_neighbors = min(15, len(sample) - 1)
+        vectorizer = reducer = reducer_2d = None
+        try:
+            vectorizer = self._build_vectorizer()
+            sample_tfidf = vectorizer.fit_transform([texts[i] for i in sample])
+            reducer = umap.UMAP(
+                n_neighbors=n_neighbors,
+                n_components=min(50, sample_tfidf.shape[1]),
+                min_dist=0.1,
+                metric='cosine',
+                random_state=42
+            )
+            sample_embeddings = reducer.fit_transform(sample_tfidf.toarray())
+            del sample_tfidf
+        except Exception as e:
+            logger.error(f"Error in vectorization: {e}")
+            vectorizer = reducer = None
+            sample_embeddings = rng.random((len(sample), 50))
+        
+        try:
+            reducer_2d = umap.UMAP(
+                n_neighbors=n_neighbors,
+                n_components=2,
+                min_dist=0.1,
+                metric='cosine',
+                random_state=42
+            ).fit(sample_embeddings)
+        except Exception as e:
+            logger.error(f"Error in 2D projection: {e}")
+            reducer_2d = None
+        dim = sample_embeddings.shape[1]
+        del sample_embeddings
+        
+        names = [ProjectArrays.EMBEDDINGS, ProjectArrays.COORDS, ProjectArrays.LABELS]
+        try:
+            # 2. 全件をチャンクごとに変換
+            embeddings = store.create(ProjectArrays.EMBEDDINGS, (n, dim), np.float32)
+            coords = store.create(ProjectArrays.COORDS, (n, 2), np.float32)
+            for start, end in chunks:
+                if reducer is not None:
+                    block = vectorizer.transform(texts[start:end]).toarray()
+                    embeddings[start:end] = reducer.transform(block)
+                else:
+                    embeddings[start:end] = rng.random((end - start, dim))
+                if reducer_2d is not None:
+                    coords[start:end] = reducer_2d.transform(embeddings[start:end])
+                else:
+                    coords[start:end] = rng.random((end - start, 2)) * 10 - 5
+            
+            # 3. チャンクを無作為な順序で複数回学習（初期化は無作為標本で行う）
+            kmeans = MiniBatchKMeans(
+                n_clusters=num_clusters,
+                random_state=42,
+                batch_size=min(chunk_size, 4096)
+            )
+            kmeans.partial_fit(np.asarray(embeddings[sample]))
+            for _ in range(settings.LARGE_SCALE_EPOCHS):
+                for i in rng.permutation(len(chunks)):
+                    start, end = chunks[i]
+                    kmeans.partial_fit(np.asarray(embeddings[start:end]))
+            
+            labels = store.create(ProjectArrays.LABELS, (n,), np.int32)
+            for start, end in chunks:
+                labels[start:end] = kmeans.predict(np.asarray(embeddings[start:end]))
+            
+            logger.info(f"Created {len(np.unique(labels))} clusters")
+            
+            return {
+                ProjectArrays.EMBEDDINGS: store.commit(ProjectArrays.EMBEDDINGS, embeddings),
+                ProjectArrays.COORDS: store.commit(ProjectArrays.COORDS, coords),
+                ProjectArrays.LABELS: store.commit(ProjectArrays.LABELS, labels)
+            }
+        except Exception:
+            # 書きかけの配列ファイルを残さない
+            for name in names:
+                store.discard(name)
+            raise
@@ -0,0 +1,131 @@
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from types import SimpleNamespace
+from typing import Any, Dict, Optional
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# 実行中の分析のID（asyncio のタスクやスレッドに引き継がれる）
+_current_run: ContextVar[Optional[str]] = ContextVar("analysis_run", default=None)
+
+
+class LLMConcurrencyBudget:
+    """プロセス全体のLLM同時リクエスト数の上限を、実行中の分析で公平に分ける
+
+    各分析の同時リクエスト数は「上限 ÷ 実行中の分析数」（最低1）までに制限される。
+    分析が1件だけなら上限すべてを使え、分析が増えると新しいリクエストから順に
+    割り当てが減る。分析に属さない呼び出しはプロセス全体の上限のみ受ける。
+    """
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.in_flight = 0
+        self.runs: Dict[str, int] = {}
+        self._condition: Optional[asyncio.Condition] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def condition(self) -> asyncio.Condition:
+        # asyncio の同期プリミティブはイベントループに紐づくため、ループごとに作り直す
+        loop = asyncio.get_running_loop()
+        if self._condition is None or self._loop is not loop:
+            self._condition = asyncio.Condition()
+            self._loop = loop
+        return self._condition
+
+    def share(self) -> int:
+        """1分析あたりの同時リクエスト数"""
+        return max(1, self.limit // max(1, len(self.runs)))
+
+    @asynccontextmanager
+    async def run(self, run_id: str):
+        """分析の実行中、この分析からのLLM呼び出しに割り当てを適用する"""
+        if run_id in self.runs:
+            raise RuntimeError(f"Analysis already running: {run_id}")
+        self.runs[run_id] = 0
+        token = _current_run.set(run_id)
+        logger.info(f"LLM budget: {len(self.runs)} active runs, {self.share()} concurrent requests each")
+        try:
+            yield
+        finally:
+            _current_run.reset(token)
+            del self.runs[run_id]
+            async with self.condition:
+                self.condition.notify_all()
+
+    def _available(self, run_id: Optional[str]) -> bool:
+        if self.in_flight >= self.limit:
+            return False
+        return run_id not in self.runs or self.runs[run_id] < self.share()
+
+    @asynccontextmanager
+    async def slot(self):
+        """LLMリクエスト1件分の枠を確保"""
+        run_id = _current_run.get()
+        condition = self.condition
+        async with condition:
+            await condition.wait_for(lambda: self._available(run_id))
+            self.in_flight += 1
+            if run_id in self.runs:
+                self.runs[run_id] += 1
+        try:
+            yield
+        finally:
+            async with condition:
+                self.in_flight -= 1
+                if run_id in self.runs:
+                    self.runs[run_id] -= 1
+                condition.notify_all()
+
+
+class CpuSlots:
+    """CPUを占有する処理（クラスタリング・numba のウォームアップ）の同時実行数の上限
+
+    numba の workqueue スレッド層（configure_numba の既定）は複数のスレッドから同時に
+    並列カーネルを実行するとプロセスごと異常終了するため、その場合は1に制限する。
+    """
+
+    def __init__(self, slots: int):
+        self.slots = max(1, slots)
+        threading_layer = os.environ.get("NUMBA_THREADING_LAYER", "workqueue")
+        if self.slots > 1 and threading_layer == "workqueue":
+            logger.warning(
+                f"CLUSTERING_SLOTS={self.slots} is not supported with the numba workqueue threading layer; using 1"
+            )
+            self.slots = 1
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @asynccontextmanager
+    async def slot(self):
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.slots)
+            self._loop = loop
+        async with self._semaphore:
+            yield
+
+
+class _GovernedCompletions:
+    def __init__(self, completions: Any):
+        self._completions = completions
+
+    async def create(self, **kwargs) -> Any:
+        async with llm_budget.slot():
+            return await self._completions.create(**kwargs)
+
+
+class GovernedClient:
+    """chat.completions.create の呼び出しに llm_budget を適用する AsyncOpenAI のラッパー"""
+
+    def __init__(self, client: Any):
+        self.client = client
+        self.chat = SimpleNamespace(completions=_GovernedCompletions(client.chat.completions))
+
+
+llm_budget = LLMConcurrencyBudget(settings.LLM_MAX_CONCURRENCY)
+cpu_slots = CpuSlots(settings.CLUSTERING_SLOTS)
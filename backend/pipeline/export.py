@@ -0,0 +1,219 @@
+import os
+import json
+import logging
+import tempfile
+from typing import List, Dict, Any, Optional, Iterator, Iterable
+import numpy as np
+import pandas as pd
+
+from pipeline.storage import ProjectArrays
+
+logger = logging.getLogger(__name__)
+
+# 出力できる列（指定がない場合はすべて出力）
+ARGUMENT_COLUMNS = [
+    "argument_id",
+    "comment_id",
+    "argument",
+    "summary",
+    "agree",
+    "disagree",
+    "cluster_id",
+    "cluster_label",
+    "x",
+    "y"
+]
+CLUSTER_COLUMNS = [
+    "cluster_id",
+    "label",
+    "summary",
+    "size",
+    "x",
+    "y",
+    "comments",
+    "agree",
+    "disagree",
+    "votes",
+    "consensus",
+    "polarization"
+]
+
+# 出力形式 → (拡張子, Content-Type)
+EXPORT_FORMATS = {
+    "csv": ("csv", "text/csv; charset=utf-8"),
+    "xlsx": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+# 列の型（Parquetのスキーマと、チャンク間で型を揃えるために使う）
+_INT_COLUMNS = {"agree", "disagree", "cluster_id", "size", "comments", "votes"}
+_FLOAT_COLUMNS = {"x", "y", "consensus", "polarization"}
+
+
+class _ByteSink:
+    """書き込まれたバイト列を溜めておき、取り出せるようにするファイル風オブジェクト"""
+
+    def __init__(self):
+        self.parts: List[bytes] = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+class ProjectExporter:
+    """分析結果をCSV / XLSX / Parquetとして書き出す
+
+    議論テーブルは args.csv をチャンク単位で読み、クラスター名を付けて
+    1チャンクずつ出力形式に変換して返す。全行をメモリに載せないため、
+    行数によらずメモリ使用量はチャンクサイズで決まる。
+    """
+
+    def __init__(self, output_dir: str, chunk_size: int = 5000):
+        self.output_dir = output_dir
+        self.chunk_size = chunk_size
+
+    def _load_clusters(self) -> List[Dict[str, Any]]:
+        with open(os.path.join(self.output_dir, "stats.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def argument_chunks(self, columns: List[str], clusters: Optional[Iterable[int]] = None) -> Iterator[pd.DataFrame]:
+        """議論テーブルをチャンク単位で読み込む
+
+        Args:
+            columns: 出力する列（ARGUMENT_COLUMNS の部分集合）
+            clusters: 指定した場合、これらのクラスターに属する議論のみ返す
+        """
+        labels_by_id = {c["cluster_id"]: c["label"] for c in self._load_clusters()}
+        wanted = np.array(sorted(set(clusters)), dtype=np.int64) if clusters is not None else None
+        store = ProjectArrays(self.output_dir)
+
+        reader = pd.read_csv(
+            os.path.join(self.output_dir, "args.csv"),
+            dtype={"argument_id": str, "comment_id": str, "argument": str, "summary": str},
+            chunksize=self.chunk_size
+        )
+        start = 0
+        for chunk in reader:
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            start += len(chunk)
+
+            # クラスター列のない（以前の形式の）args.csv は保存済みの配列から補う
+            if "cluster_id" not in chunk.columns:
+                chunk["cluster_id"] = np.asarray(store.labels[chunk.index[0]:chunk.index[-1] + 1])
+                coords = np.asarray(store.coords[chunk.index[0]:chunk.index[-1] + 1])
+                chunk["x"] = coords[:, 0]
+                chunk["y"] = coords[:, 1]
+
+            if wanted is not None:
+                chunk = chunk[np.isin(chunk["cluster_id"].to_numpy(), wanted)]
+                if chunk.empty:
+                    continue
+
+            chunk["cluster_label"] = chunk["cluster_id"].map(labels_by_id)
+            yield self._conform(chunk, columns)
+
+    def cluster_table(self, columns: List[str], clusters: Optional[Iterable[int]] = None) -> pd.DataFrame:
+        """クラスターごとの概要と賛否の集計（1クラスター1行）"""
+        rows = [
+            {**{k: v for k, v in c.items() if k != "stats"}, **{k: v for k, v in c["stats"].items() if k != "top_arguments"}}
+            for c in self._load_clusters()
+        ]
+        table = pd.DataFrame(rows, columns=CLUSTER_COLUMNS)
+        if clusters is not None:
+            table = table[table["cluster_id"].isin(set(clusters))]
+        return self._conform(table, columns)
+
+    @staticmethod
+    def _conform(frame: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+        """列を選び、チャンク間で型を揃える（欠損値を含む整数列は nullable 型）"""
+        frame = frame.reindex(columns=columns)
+        for name in columns:
+            if name in _INT_COLUMNS:
+                frame[name] = pd.to_numeric(frame[name], errors="coerce").round().astype("Int64")
+            elif name in _FLOAT_COLUMNS:
+                frame[name] = pd.to_numeric(frame[name], errors="coerce").astype(np.float64)
+            else:
+                frame[name] = frame[name].astype(object).where(frame[name].notna(), None)
+        return frame
+
+    def stream(self, chunks: Iterable[pd.DataFrame], columns: List[str], fmt: str) -> Iterator[bytes]:
+        """チャンクを指定の形式のバイト列に変換しながら返す"""
+        if fmt == "csv":
+            return self._stream_csv(chunks, columns)
+        if fmt == "xlsx":
+            return self._stream_xlsx(chunks, columns)
+        if fmt == "parquet":
+            return self._stream_parquet(chunks, columns)
+        raise ValueError(f"Unsupported export format: {fmt}")
+
+    @staticmethod
+    def _stream_csv(chunks: Iterable[pd.DataFrame], columns: List[str]) -> Iterator[bytes]:
+        # ExcelでそのままUTF-8として開けるようにBOMを付ける
+        yield ("\ufeff" + ",".join(columns) + "\n").encode("utf-8")
+        for chunk in chunks:
+            yield chunk.to_csv(index=False, header=False).encode("utf-8")
+
+    @staticmethod
+    def _stream_xlsx(chunks: Iterable[pd.DataFrame], columns: List[str]) -> Iterator[bytes]:
+        # XLSXはZIP形式で、末尾まで書き終えないと出力できないため、
+        # 書き込み専用モード（行をメモリに保持しない）で一時ファイルに書いてから返す
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet("data")
+        sheet.append(columns)
+        for chunk in chunks:
+            for row in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None):
+                sheet.append(row)
+
+        fd, path = tempfile.mkstemp(suffix=".xlsx")
+        os.close(fd)
+        try:
+            workbook.save(path)
+            with open(path, "rb") as f:
+                while True:
+                    data = f.read(1024 * 1024)
+                    if not data:
+                        break
+                    yield data
+        finally:
+            os.remove(path)
+
+    @staticmethod
+    def _stream_parquet(chunks: Iterable[pd.DataFrame], columns: List[str]) -> Iterator[bytes]:
+        # チャンクごとに行グループとして書き込み、書けた分から返す
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema([
+            (name, pa.int64() if name in _INT_COLUMNS else pa.float64() if name in _FLOAT_COLUMNS else pa.string())
+            for name in columns
+        ])
+        sink = _ByteSink()
+        writer = pq.ParquetWriter(sink, schema, compression="snappy")
+        try:
+            for chunk in chunks:
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+                yield sink.drain()
+        finally:
+            writer.close()
+        yield sink.drain()
@@ -1,32 +1,85 @@
 import asyncio
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import pandas as pd
 from openai import AsyncOpenAI
-import json
 from config import settings
+from pipeline.llm_utils import (
+    ParseStats,
+    parse_or_repair,
+    response_payload,
+    structured_output_kwargs
+)
+from pipeline.routing import route_comment
+from pipeline.concurrency import GovernedClient
 
 logger = logging.getLogger(__name__)
 
+# LLMに出力させる項目と説明（api.models.ExtractedArgument のうちIDなどを除いたもの）
+EXTRACTION_FIELDS = {
+    "argument": "コメントから抽出された、具体的で明確な議論や意見",
+    "summary": "議論の短い要約（20文字以内）"
+}
+
+def build_extraction_tool() -> Dict[str, Any]:
+    """抽出用の関数定義を作成"""
+    item = {
+        "type": "object",
+        "properties": {
+            field: {"type": "string", "description": description}
+            for field, description in EXTRACTION_FIELDS.items()
+        },
+        "required": list(EXTRACTION_FIELDS)
+    }
+    return {
+        "name": "record_arguments",
+        "description": "コメントから抽出した議論を記録する",
+        "parameters": {
+            "type": "object",
+            "properties": {"arguments": {"type": "array", "items": item}},
+            "required": ["arguments"]
+        }
+    }
+
+EXTRACTION_TOOL = build_extraction_tool()
+EXTRACTION_FORMAT_HINT = '{"arguments": [{"argument": "議論や意見", "summary": "短い要約"}]}'
+
+def is_valid_extraction(data: Any) -> bool:
+    """抽出結果が期待する構造かどうか"""
+    return isinstance(data, dict) and isinstance(data.get("arguments"), list) and all(
+        isinstance(arg, dict) for arg in data["arguments"]
+    )
+
 class ArgumentExtractor:
     """コメントから議論を抽出するクラス"""
     
     def __init__(self):
-        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+        self.client = GovernedClient(AsyncOpenAI(api_key=settings.OPENAI_API_KEY))
     
     async def extract_arguments(
         self,
         df: pd.DataFrame,
         question: str,
         model: str = "gpt-3.5-turbo",
-        limit: int = 1000,
-        workers: int = 3
+        limit: Optional[int] = None,
+        workers: int = 3,
+        parse_stats: Optional[ParseStats] = None,
+        routing: bool = True,
+        routing_log: Optional[List[Dict[str, Any]]] = None
     ) -> List[Dict[str, Any]]:
-        """コメントから議論を抽出"""
+        """コメントから議論を抽出
+
+        limit を指定した場合は先頭の limit 件のみ抽出する（既定では制限しない）。
+        parse_stats を渡すと、応答の解析結果（失敗・修復の件数）を集計する。
+        routing=True の場合、意見を含まないコメントは抽出せず、短いコメントはLLMを使わずに
+        そのまま議論とし、長い・複雑なコメントのみ settings.EXTRACTION_STRONG_MODEL で抽出する。
+        routing_log を渡すと、コメントごとの経路（route / model / max_tokens / reason）を追記する。
+        """
         logger.info(f"Extracting arguments from {len(df)} comments")
         
-        # 処理するコメント数を制限
-        if len(df) > limit:
+        # 処理するコメント数を制限（指定された場合のみ）
+        if limit and len(df) > limit:
+            logger.warning(f"Extraction limited to the first {limit} of {len(df)} comments")
             df = df.head(limit)
         
         # バッチ処理用にコメントを分割
@@ -36,7 +89,7 @@ class ArgumentExtractor:
         # 並列処理で抽出
         tasks = []
         for batch in batches:
-            task = self._extract_batch(batch, question, model)
+            task = self._extract_batch(batch, question, model, parse_stats, routing, routing_log)
             tasks.append(task)
         
         results = await asyncio.gather(*tasks)
@@ -53,7 +106,10 @@ class ArgumentExtractor:
         self,
         batch: pd.DataFrame,
         question: str,
-        model: str
+        model: str,
+        parse_stats: Optional[ParseStats] = None,
+        routing: bool = True,
+        routing_log: Optional[List[Dict[str, Any]]] = None
     ) -> List[Dict[str, Any]]:
         """バッチ単位で議論を抽出"""
         arguments = []
@@ -61,29 +117,40 @@ class ArgumentExtractor:
         for _, row in batch.iterrows():
             comment_id = row['comment-id']
             comment_body = row['comment-body']
+            comment_body = '' if pd.isna(comment_body) else str(comment_body)
+            
+            decision = self._route(comment_body, model, routing)
+            decision.update(comment_id=comment_id, arguments=0)
+            if routing_log is not None:
+                routing_log.append(decision)
             
-            # コメントが空の場合はスキップ
-            if pd.isna(comment_body) or str(comment_body).strip() == '':
+            # 空・意見を含まないコメントはスキップ
+            if decision["route"] == "skip":
                 continue
             
             try:
-                # プロンプトを構築
-                prompt = self._build_prompt(question, comment_body)
+                if decision["route"] == "local":
+                    # 短いコメントはそのまま議論・要約とする
+                    text = comment_body.strip()
+                    extracted = self._format_extraction(
+                        {"arguments": [{"argument": text, "summary": text}]},
+                        comment_id
+                    )
+                else:
+                    extracted = await self._extract_comment(
+                        question,
+                        comment_body,
+                        comment_id,
+                        decision["model"],
+                        decision["max_tokens"],
+                        parse_stats
+                    )
+                decision["arguments"] = len(extracted)
                 
-                # OpenAI APIを呼び出し
-                response = await self.client.chat.completions.create(
-                    model=model,
-                    messages=[
-                        {"role": "system", "content": "あなたは市民のコメントから主要な議論や意見を抽出する専門家です。"},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.3,
-                    max_tokens=500
-                )
-                
-                # レスポンスを解析
-                content = response.choices[0].message.content
-                extracted = self._parse_extraction(content, comment_id)
+                # 賛成・反対票はコメント単位の値を各議論に引き継ぐ
+                votes = self._read_votes(row)
+                for arg in extracted:
+                    arg.update(votes)
                 
                 if extracted:
                     arguments.extend(extracted)
@@ -94,6 +161,72 @@ class ArgumentExtractor:
         
         return arguments
     
+    def _route(self, comment: str, model: str, routing: bool) -> Dict[str, Any]:
+        """コメントの抽出方法を決める（routing=False の場合は空のコメントのみスキップ）"""
+        if not routing:
+            return {
+                "route": "fast" if comment.strip() else "skip",
+                "model": model if comment.strip() else None,
+                "max_tokens": 500,
+                "reason": "routing_disabled" if comment.strip() else "empty",
+                "chars": len(comment.strip())
+            }
+        return route_comment(
+            comment,
+            fast_model=model,
+            strong_model=settings.EXTRACTION_STRONG_MODEL or None,
+            local_max_chars=settings.EXTRACTION_LOCAL_MAX_CHARS,
+            strong_min_chars=settings.EXTRACTION_STRONG_MIN_CHARS,
+            strong_min_sentences=settings.EXTRACTION_STRONG_MIN_SENTENCES,
+            max_tokens_cap=settings.EXTRACTION_MAX_TOKENS
+        )
+    
+    async def _extract_comment(
+        self,
+        question: str,
+        comment: str,
+        comment_id: str,
+        model: str,
+        max_tokens: int,
+        parse_stats: Optional[ParseStats] = None
+    ) -> List[Dict[str, Any]]:
+        """1件のコメントからLLMで議論を抽出"""
+        # プロンプトを構築
+        prompt = self._build_prompt(question, comment)
+        
+        # OpenAI APIを呼び出し
+        response = await self.client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": "あなたは市民のコメントから主要な議論や意見を抽出する専門家です。"},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.3,
+            max_tokens=max_tokens,
+            **structured_output_kwargs(settings.STRUCTURED_OUTPUT, EXTRACTION_TOOL)
+        )
+        
+        # レスポンスを解析（失敗した場合は修復を試みる）
+        content = response_payload(response)
+        data = await parse_or_repair(
+            self.client,
+            model,
+            content,
+            is_valid_extraction,
+            EXTRACTION_FORMAT_HINT,
+            parse_stats,
+            "extraction"
+        )
+        return self._format_extraction(data, comment_id) if data else []
+    
+    def _read_votes(self, row: pd.Series) -> Dict[str, int]:
+        """CSVの agree / disagree 列を読み込む（列がない・値が不正な場合は0）"""
+        votes = {}
+        for column in ['agree', 'disagree']:
+            value = pd.to_numeric(row.get(column), errors='coerce')
+            votes[column] = 0 if pd.isna(value) else max(0, int(value))
+        return votes
+    
     def _build_prompt(self, question: str, comment: str) -> str:
         """抽出用のプロンプトを構築"""
         return f"""質問: {question}
@@ -118,36 +251,18 @@ class ArgumentExtractor:
 - 要約は簡潔にしてください
 """
     
-    def _parse_extraction(self, content: str, comment_id: str) -> List[Dict[str, Any]]:
-        """抽出結果を解析"""
-        try:
-            # コードブロックやマークダウンを削除
-            content = content.strip()
-            if content.startswith('```json'):
-                content = content[7:]
-            if content.startswith('```'):
-                content = content[3:]
-            if content.endswith('```'):
-                content = content[:-3]
-            content = content.strip()
-            
-            # JSONとして解析
-            data = json.loads(content)
-            arguments = data.get('arguments', [])
-            
-            # 結果を整形
-            result = []
-            for i, arg in enumerate(arguments):
-                result.append({
-                    "argument_id": f"{comment_id}_{i}",
-                    "comment_id": comment_id,
-                    "argument": arg.get('argument', ''),
-                    "summary": arg.get('summary', '')
-                })
-            
-            return result
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse JSON for comment {comment_id}: {e}")
-            logger.error(f"Content was: {content[:200]}...")
-            return []
+    def _format_extraction(self, data: Dict[str, Any], comment_id: str) -> List[Dict[str, Any]]:
+        """解析済みの抽出結果を整形（空の議論は除く）"""
+        result = []
+        for arg in data.get('arguments', []):
+            argument = str(arg.get('argument') or '').strip()
+            if not argument:
+                continue
+            result.append({
+                "argument_id": f"{comment_id}_{len(result)}",
+                "comment_id": comment_id,
+                "argument": argument,
+                "summary": str(arg.get('summary') or '').strip()
+            })
+        
+        return result
@@ -1,125 +1,359 @@
 import asyncio
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from openai import AsyncOpenAI
-import json
-import random
+import re
+import numpy as np
+import pandas as pd
 from config import settings
+from pipeline.concurrency import GovernedClient
+from pipeline.cache import JsonCache
+from pipeline.clustering import group_by_cluster, compute_centroids
+from pipeline.sampling import select_representatives
+from pipeline.stats import vote_columns
+from pipeline.llm_utils import (
+    ParseStats,
+    estimate_tokens,
+    pack_by_budget,
+    parse_or_repair,
+    response_payload,
+    structured_output_kwargs
+)
 
 logger = logging.getLogger(__name__)
 
+LABEL_FORMAT_HINT = '{"label": "ラベル", "summary": "要約"}'
+JOINT_LABEL_FORMAT_HINT = '{"labels": [{"cluster_id": 0, "label": "ラベル", "summary": "要約"}]}'
+
+# 漢字・カタカナの連続、または英単語を特徴語の候補とする（ひらがなは助詞などが多いため除く）
+_KEY_TERM_PATTERN = re.compile(r"[\u4e00-\u9fff\u30a0-\u30ff\u30fc]{2,}|[A-Za-z][A-Za-z0-9]{2,}")
+
 class ClusterLabeler:
     """クラスターにラベルを生成するクラス"""
     
     def __init__(self):
-        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+        self.client = GovernedClient(AsyncOpenAI(api_key=settings.OPENAI_API_KEY))
+        self.cache = JsonCache("labels")
     
     async def generate_labels(
         self,
-        clusters: Dict[int, List[Dict[str, Any]]],
+        args_df: pd.DataFrame,
+        labels: np.ndarray,
+        coords: np.ndarray,
+        embeddings: np.ndarray,
         model: str = "gpt-3.5-turbo",
-        sample_size: int = 20
+        sample_size: int = 20,
+        seed: int = 42,
+        mode: str = "joint",
+        parse_stats: Optional[ParseStats] = None
     ) -> List[Dict[str, Any]]:
-        """各クラスターにラベルと要約を生成"""
-        logger.info(f"Generating labels for {len(clusters)} clusters")
+        """各クラスターにラベルと要約を生成
+
+        Args:
+            args_df: 議論テーブル（行は labels / coords と同じ順序）
+            labels: 各議論のクラスターID
+            coords: 各議論の2D座標
+            embeddings: 各議論の埋め込み（代表的な議論の選択に使用）
+            seed: サンプリングの乱数シード
+            mode: "joint"（全クラスターを一括でラベリング）または "individual"（クラスターごと）
+            parse_stats: 応答の解析結果の集計先
+
+        Returns:
+            クラスターごとのメタデータ（議論そのものは含まない）
+        """
+        groups = group_by_cluster(labels)
+        centroids = compute_centroids(labels, coords)
+        texts = args_df['argument'].to_numpy()
+        agree = vote_columns(args_df)['agree']
+        
+        logger.info(f"Generating labels for {len(groups)} clusters ({mode} mode)")
+        
+        clusters = {}
+        samples = {}
+        for cluster_id, rows in groups.items():
+            clusters[cluster_id] = self._base_cluster(cluster_id, len(rows), centroids[cluster_id])
+            samples[cluster_id] = self._sample_representatives(
+                texts[rows],
+                embeddings[rows],
+                agree[rows],
+                sample_size,
+                seed
+            )
         
+        if mode == "joint" and len(groups) > 1:
+            key_terms = self._extract_key_terms({cid: texts[rows] for cid, rows in groups.items()})
+            joint_labels = await self._generate_joint_labels(samples, key_terms, model, parse_stats)
+            for cluster_id, label_data in joint_labels.items():
+                clusters[cluster_id].update(label_data)
+            pending = [cid for cid in groups if cid not in joint_labels]
+            if pending:
+                logger.warning(f"Falling back to per-cluster labeling for clusters {pending}")
+        else:
+            pending = list(groups)
+        
+        # 個別ラベリング（joint モードでは解析に失敗したクラスターのみ）
         tasks = []
-        for cluster_id, arguments in clusters.items():
+        for cluster_id in pending:
             task = self._generate_cluster_label(
                 cluster_id,
-                arguments,
+                samples[cluster_id],
+                clusters[cluster_id]["size"],
+                centroids[cluster_id],
                 model,
-                sample_size
+                parse_stats
             )
             tasks.append(task)
         
-        labeled_clusters = await asyncio.gather(*tasks)
+        for cluster in await asyncio.gather(*tasks):
+            clusters[cluster["cluster_id"]] = cluster
         
         logger.info("Labels generated successfully")
-        return labeled_clusters
+        return list(clusters.values())
+    
+    def _base_cluster(self, cluster_id: int, size: int, centroid: np.ndarray) -> Dict[str, Any]:
+        """ラベル未設定のクラスターデータを作成"""
+        return {
+            "cluster_id": cluster_id,
+            "label": f"クラスター{cluster_id + 1}",
+            "summary": "ラベル生成に失敗しました",
+            "size": size,
+            "x": float(centroid[0]),
+            "y": float(centroid[1])
+        }
+    
+    def _extract_key_terms(self, texts_by_cluster: Dict[int, np.ndarray], top_n: int = 5) -> Dict[int, List[str]]:
+        """クラスターごとの特徴語を抽出（クラスター単位のTF-IDF）
+
+        日本語は分かち書きされていないため、漢字・カタカナの連続を語とみなし、
+        他のクラスターに比べて特に多く現れるものを特徴語とする。
+        """
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        
+        cluster_ids = list(texts_by_cluster)
+        documents = ["\n".join(texts_by_cluster[cid].astype(str)) for cid in cluster_ids]
+        try:
+            vectorizer = TfidfVectorizer(analyzer=_KEY_TERM_PATTERN.findall, lowercase=False, sublinear_tf=True)
+            matrix = vectorizer.fit_transform(documents).toarray()
+        except ValueError:
+            return {cid: [] for cid in cluster_ids}
+        
+        terms = vectorizer.get_feature_names_out()
+        key_terms = {}
+        for i, cid in enumerate(cluster_ids):
+            chosen = []
+            for col in np.argsort(-matrix[i], kind="stable"):
+                term = terms[col]
+                if matrix[i, col] <= 0 or len(chosen) >= top_n:
+                    break
+                # 既に選んだ語と重なる語は除く
+                if any(term in c or c in term for c in chosen):
+                    continue
+                chosen.append(term)
+            key_terms[cid] = chosen
+        return key_terms
+    
+    async def _generate_joint_labels(
+        self,
+        samples: Dict[int, List[str]],
+        key_terms: Dict[int, List[str]],
+        model: str,
+        parse_stats: Optional[ParseStats] = None
+    ) -> Dict[int, Dict[str, str]]:
+        """全クラスターの要約情報をまとめて送り、一度にラベルを生成
+
+        トークン予算を超える場合は複数のリクエストに分け、先に付けたラベルを
+        後続のリクエストに伝えて重複を避ける。
+
+        Returns:
+            クラスターID → {"label", "summary"}（解析できたクラスターのみ）
+        """
+        digests = {
+            cid: self._build_cluster_digest(cid, texts[:settings.LABEL_JOINT_DIGEST_SIZE], key_terms.get(cid, []))
+            for cid, texts in samples.items()
+        }
+        batches = pack_by_budget(
+            list(digests),
+            [estimate_tokens(digest) for digest in digests.values()],
+            settings.LABEL_JOINT_TOKEN_BUDGET
+        )
+        
+        results: Dict[int, Dict[str, str]] = {}
+        for batch in batches:
+            assigned = [data["label"] for data in results.values()]
+            prompt = self._build_joint_label_prompt([digests[cid] for cid in batch], assigned)
+            messages = [
+                {"role": "system", "content": "あなたは議論のグループにわかりやすいラベルと要約を付ける専門家です。必ずJSON形式で回答してください。"},
+                {"role": "user", "content": prompt}
+            ]
+            
+            cache_key = self.cache.make_key(model, messages)
+            cached = self.cache.get(cache_key)
+            if cached:
+                results.update({int(cid): data for cid, data in cached.items()})
+                continue
+            
+            try:
+                response = await self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=0.3,
+                    max_tokens=100 * len(batch) + 100,
+                    **structured_output_kwargs(settings.STRUCTURED_OUTPUT)
+                )
+                data = await parse_or_repair(
+                    self.client,
+                    model,
+                    response_payload(response),
+                    lambda d: isinstance(d, dict) and isinstance(d.get('labels'), list),
+                    JOINT_LABEL_FORMAT_HINT,
+                    parse_stats,
+                    "labeling"
+                )
+                parsed = self._format_joint_labels(data, batch) if data else {}
+            except Exception as e:
+                logger.error(f"Error generating joint labels for clusters {batch}: {e}")
+                continue
+            
+            results.update(parsed)
+            if len(parsed) == len(batch):
+                self.cache.set(cache_key, {str(cid): data for cid, data in parsed.items()})
+        
+        return results
+    
+    def _build_cluster_digest(self, cluster_id: int, texts: List[str], key_terms: List[str]) -> str:
+        """一括ラベリング用のクラスター要約情報を作成"""
+        args_str = "\n".join([f"  - {text}" for text in texts])
+        terms_str = "、".join(key_terms) if key_terms else "なし"
+        return f"""グループID: {cluster_id}
+特徴語: {terms_str}
+代表的な議論:
+{args_str}"""
+    
+    def _build_joint_label_prompt(self, digests: List[str], assigned_labels: List[str]) -> str:
+        """一括ラベリング用のプロンプトを構築"""
+        groups_str = "\n\n".join(digests)
+        assigned_str = ""
+        if assigned_labels:
+            assigned_str = "\n既に他のグループに付けたラベル（これらと重複しないこと）:\n" + "\n".join(
+                [f"- {label}" for label in assigned_labels]
+            ) + "\n"
+        
+        return f"""以下は市民の意見をグループ分けした結果です。すべてのグループを見比べて、各グループにラベルと要約を付けてください。
+
+{groups_str}
+{assigned_str}
+以下の形式でJSONとして出力してください：
+
+{{
+  "labels": [
+    {{
+      "cluster_id": グループID（数値）,
+      "label": "短くわかりやすいラベル（15文字以内）",
+      "summary": "このグループの議論を要約した説明（50文字以内）"
+    }}
+  ]
+}}
+
+注意事項：
+- すべてのグループについて出力してください
+- 各ラベルは他のすべてのグループと明確に区別できるものにしてください
+- 「公園施設」のような一般的すぎるラベルは避け、具体的な特徴を含めてください
+- 要約は議論の共通点や主要なテーマを表現してください
+- 日本語で出力してください
+"""
+    
+    def _sample_representatives(
+        self,
+        texts: np.ndarray,
+        embeddings: np.ndarray,
+        agree: np.ndarray,
+        sample_size: int,
+        seed: int
+    ) -> List[str]:
+        """ラベル生成に使う代表的な議論を選択
+
+        同じ文面の議論はまとめ、重複数と賛成票数の合計を重みとして扱う。
+        """
+        unique_texts, first_index, inverse, counts = np.unique(
+            texts.astype(str),
+            return_index=True,
+            return_inverse=True,
+            return_counts=True
+        )
+        weights = counts + np.bincount(inverse.ravel(), weights=agree, minlength=len(unique_texts))
+        selected = select_representatives(
+            embeddings[first_index],
+            sample_size,
+            weights=weights,
+            seed=seed
+        )
+        return unique_texts[selected].tolist()
     
     async def _generate_cluster_label(
         self,
         cluster_id: int,
-        arguments: List[Dict[str, Any]],
+        sampled_texts: List[str],
+        size: int,
+        centroid: np.ndarray,
         model: str,
-        sample_size: int
+        parse_stats: Optional[ParseStats] = None
     ) -> Dict[str, Any]:
         """個別のクラスターにラベルを生成"""
         
-        # サンプリング
-        if len(arguments) > sample_size:
-            sampled_args = random.sample(arguments, sample_size)
-        else:
-            sampled_args = arguments
+        cluster = self._base_cluster(cluster_id, size, centroid)
         
         # プロンプトを構築
-        prompt = self._build_label_prompt(sampled_args)
+        prompt = self._build_label_prompt(sampled_texts)
+        messages = [
+            {"role": "system", "content": "あなたは議論のグループにわかりやすいラベルと要約を付ける専門家です。必ずJSON形式で回答してください。"},
+            {"role": "user", "content": prompt}
+        ]
+        
+        # サンプルは決定的に選ばれるため、同じ議論に対する再実行ではキャッシュを再利用できる
+        cache_key = self.cache.make_key(model, messages)
+        cached = self.cache.get(cache_key)
+        if cached:
+            cluster.update(cached)
+            return cluster
         
         try:
             # OpenAI APIを呼び出し
             response = await self.client.chat.completions.create(
                 model=model,
-                messages=[
-                    {"role": "system", "content": "あなたは議論のグループにわかりやすいラベルと要約を付ける専門家です。必ずJSON形式で回答してください。"},
-                    {"role": "user", "content": prompt}
-                ],
+                messages=messages,
                 temperature=0.3,
-                max_tokens=300
+                max_tokens=300,
+                **structured_output_kwargs(settings.STRUCTURED_OUTPUT)
             )
             
-            # レスポンスを解析
-            content = response.choices[0].message.content
-            label_data = self._parse_label_response(content)
-            
-            # クラスターの中心座標を計算（argumentsに座標が含まれている場合）
-            x_coords = [arg.get('x', 0) for arg in arguments if 'x' in arg]
-            y_coords = [arg.get('y', 0) for arg in arguments if 'y' in arg]
+            # レスポンスを解析（失敗した場合は修復を試みる）
+            data = await parse_or_repair(
+                self.client,
+                model,
+                response_payload(response),
+                lambda d: isinstance(d, dict) and bool(d.get('label')),
+                LABEL_FORMAT_HINT,
+                parse_stats,
+                "labeling"
+            )
+            label_data = {
+                'label': str(data.get('label') or ''),
+                'summary': str(data.get('summary') or '')
+            } if data else {}
             
-            if x_coords and y_coords:
-                center_x = sum(x_coords) / len(x_coords)
-                center_y = sum(y_coords) / len(y_coords)
-            else:
-                # 座標がない場合はランダムに配置
-                center_x = random.uniform(-5, 5)
-                center_y = random.uniform(-5, 5)
+            cluster["label"] = label_data.get('label') or cluster["label"]
+            cluster["summary"] = label_data.get('summary', '')
             
-            return {
-                "cluster_id": cluster_id,
-                "label": label_data.get('label', f'クラスター{cluster_id + 1}'),
-                "summary": label_data.get('summary', ''),
-                "arguments": arguments,
-                "size": len(arguments),
-                "x": center_x,
-                "y": center_y
-            }
+            if label_data.get('label'):
+                self.cache.set(cache_key, {"label": cluster["label"], "summary": cluster["summary"]})
             
         except Exception as e:
             logger.error(f"Error generating label for cluster {cluster_id}: {e}")
-            # エラー時のフォールバック
-            x_coords = [arg.get('x', 0) for arg in arguments if 'x' in arg]
-            y_coords = [arg.get('y', 0) for arg in arguments if 'y' in arg]
-            
-            if x_coords and y_coords:
-                center_x = sum(x_coords) / len(x_coords)
-                center_y = sum(y_coords) / len(y_coords)
-            else:
-                center_x = random.uniform(-5, 5)
-                center_y = random.uniform(-5, 5)
-            
-            return {
-                "cluster_id": cluster_id,
-                "label": f"クラスター{cluster_id + 1}",
-                "summary": "ラベル生成に失敗しました",
-                "arguments": arguments,
-                "size": len(arguments),
-                "x": center_x,
-                "y": center_y
-            }
+        
+        return cluster
     
-    def _build_label_prompt(self, arguments: List[Dict[str, Any]]) -> str:
+    def _build_label_prompt(self, arg_texts: List[str]) -> str:
         """ラベル生成用のプロンプトを構築"""
-        arg_texts = [arg['argument'] for arg in arguments]
         args_str = "\n".join([f"- {text}" for text in arg_texts])
         
         return f"""以下の議論のグループに、他のグループと区別できる特徴的なラベルと要約を付けてください。
@@ -142,28 +376,19 @@ class ClusterLabeler:
 - 日本語で出力してください
 """
     
-    def _parse_label_response(self, content: str) -> Dict[str, str]:
-        """ラベル生成の応答を解析"""
-        try:
-            # コードブロックやマークダウンを削除
-            content = content.strip()
-            if content.startswith('```json'):
-                content = content[7:]
-            if content.startswith('```'):
-                content = content[3:]
-            if content.endswith('```'):
-                content = content[:-3]
-            content = content.strip()
-            
-            data = json.loads(content)
-            return {
-                'label': data.get('label', ''),
-                'summary': data.get('summary', '')
-            }
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse label response as JSON: {e}")
-            logger.error(f"Content was: {content}")
-            return {
-                'label': '',
-                'summary': ''
-            }
+    def _format_joint_labels(self, data: Dict[str, Any], cluster_ids: List[int]) -> Dict[int, Dict[str, str]]:
+        """一括ラベリングの結果を整形（要求したクラスターのうち有効なもののみ返す）"""
+        expected = set(cluster_ids)
+        results = {}
+        for item in data.get('labels', []):
+            try:
+                cluster_id = int(item.get('cluster_id'))
+            except (TypeError, ValueError, AttributeError):
+                continue
+            label = str(item.get('label') or '').strip()
+            if cluster_id in expected and label:
+                results[cluster_id] = {
+                    'label': label,
+                    'summary': str(item.get('summary') or '')
+                }
+        return results
@@ -0,0 +1,248 @@
+import re
+import json
+import logging
+from typing import Any, Callable, Dict, List, Optional, Sequence, TypeVar
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_FENCE_PATTERN = re.compile(r"```(?:json)?\s*(.*?)\s*(?:```|$)", re.DOTALL)
+_TRAILING_COMMA_PATTERN = re.compile(r",\s*([}\]])")
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数を概算する
+
+    日本語はおおよそ1文字 = 1トークン、英語は4文字 = 1トークン程度のため、
+    非ASCII文字は1文字1トークン、ASCII文字は4文字1トークンとして見積もる。
+    """
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return non_ascii + (len(text) - non_ascii) // 4 + 1
+
+
+def pack_by_budget(items: Sequence[T], sizes: Sequence[int], budget: int, max_items: int = 0) -> List[List[T]]:
+    """トークン予算に収まるように要素をまとめてバッチに分ける
+
+    1要素だけで予算を超える場合は、その要素単独のバッチにする。
+
+    Args:
+        items: 分割する要素
+        sizes: 各要素の推定トークン数
+        budget: 1バッチあたりのトークン予算
+        max_items: 1バッチあたりの最大要素数（0の場合は無制限）
+    """
+    batches: List[List[T]] = []
+    current: List[T] = []
+    used = 0
+    for item, size in zip(items, sizes):
+        if current and (used + size > budget or (max_items and len(current) >= max_items)):
+            batches.append(current)
+            current, used = [], 0
+        current.append(item)
+        used += size
+    if current:
+        batches.append(current)
+    return batches
+
+
+def strip_code_fence(content: str) -> str:
+    """マークダウンのコードブロックを取り除く"""
+    content = (content or "").strip()
+    match = _FENCE_PATTERN.search(content)
+    if match:
+        content = match.group(1)
+    return content.strip()
+
+
+def _close_brackets(text: str) -> str:
+    """途中で切れたJSON（max_tokens 到達など）の閉じ括弧と引用符を補う"""
+    stack = []
+    in_string = False
+    escaped = False
+    for ch in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+    if in_string:
+        text += '"'
+    text = _TRAILING_COMMA_PATTERN.sub(r"\1", text.rstrip().rstrip(","))
+    return text + "".join(reversed(stack))
+
+
+def parse_json_response(content: Optional[str]) -> Optional[Any]:
+    """LLMの応答をJSONとして解析（多少壊れていても修復を試みる）
+
+    以下の順に試し、すべて失敗した場合は None を返す。
+    1. コードブロックを除いてそのまま解析
+    2. 前後の説明文を除き、最初の { / [ から最後の } / ] までを解析
+    3. 末尾のカンマの削除、全角引用符の置換、閉じ括弧の補完
+    """
+    text = strip_code_fence(content or "")
+    if not text:
+        return None
+
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return None
+    text = text[min(starts):]
+    end = max(text.rfind("}"), text.rfind("]"))
+    candidates = [text[:end + 1]] if end >= 0 else []
+    candidates.append(text)
+
+    for candidate in candidates:
+        for repaired in (
+            candidate,
+            _TRAILING_COMMA_PATTERN.sub(r"\1", candidate),
+            _close_brackets(candidate.replace("“", '"').replace("”", '"'))
+        ):
+            try:
+                return json.loads(repaired)
+            except json.JSONDecodeError:
+                continue
+    return None
+
+
+def response_payload(response: Any) -> str:
+    """応答本文を取得（ツール呼び出しの場合はその引数のJSON）"""
+    message = response.choices[0].message
+    tool_calls = getattr(message, "tool_calls", None)
+    if tool_calls:
+        return tool_calls[0].function.arguments or ""
+    return message.content or ""
+
+
+class ParseStats:
+    """LLM応答の解析結果の集計（段階ごと）
+
+    - requests: 解析した応答の数
+    - parsed: そのまま解析できた数
+    - repaired: 修復パーサーで解析できた数
+    - retried: 修復プロンプトで再リクエストした数
+    - recovered: 再リクエストで解析できた数
+    - failed: 最終的に解析できず破棄した数
+    """
+
+    FIELDS = ["requests", "parsed", "repaired", "retried", "recovered", "failed"]
+
+    def __init__(self):
+        self.counts: Dict[str, Dict[str, int]] = {}
+
+    def increment(self, stage: str, field: str, count: int = 1):
+        stage_counts = self.counts.setdefault(stage, dict.fromkeys(self.FIELDS, 0))
+        stage_counts[field] += count
+
+    def as_dict(self) -> Dict[str, Dict[str, Any]]:
+        """段階ごとの件数と失敗率"""
+        result = {}
+        for stage, counts in self.counts.items():
+            requests = counts["requests"]
+            result[stage] = dict(counts)
+            result[stage]["parse_failure_rate"] = round(
+                (requests - counts["parsed"]) / requests, 4
+            ) if requests else 0.0
+            result[stage]["drop_rate"] = round(counts["failed"] / requests, 4) if requests else 0.0
+        return result
+
+
+def structured_output_kwargs(mode: str, tool: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """構造化出力のためのAPIパラメータ
+
+    Args:
+        mode: "tools"（関数呼び出しでスキーマを強制）、"json"（JSONモード）、"off"
+        tool: mode="tools" の場合に使う関数定義（name / description / parameters）
+    """
+    if mode == "tools" and tool:
+        return {
+            "tools": [{"type": "function", "function": tool}],
+            "tool_choice": {"type": "function", "function": {"name": tool["name"]}}
+        }
+    if mode in ("tools", "json"):
+        return {"response_format": {"type": "json_object"}}
+    return {}
+
+
+async def parse_or_repair(
+    client: Any,
+    model: str,
+    content: str,
+    validate: Callable[[Any], bool],
+    format_hint: str,
+    stats: Optional[ParseStats] = None,
+    stage: str = "default",
+    mode: Optional[str] = None
+) -> Optional[Any]:
+    """応答を解析し、失敗した場合は修復パーサー → 修復プロンプトの順に回復を試みる
+
+    修復プロンプトには元の入力を含めず、壊れた応答と期待する形式のみを送るため、
+    元のリクエストをやり直すより安く済む。
+
+    Args:
+        validate: 解析結果が期待する構造かどうかを判定する関数
+        format_hint: 期待するJSONの形式（修復プロンプトに含める）
+        stage: 集計用の段階名
+        mode: 修復プロンプトに使う構造化出力の方式（省略時は settings.STRUCTURED_OUTPUT。
+            "off" の場合は response_format を送らない）
+    """
+    stats = stats or ParseStats()
+    stats.increment(stage, "requests")
+
+    try:
+        data = json.loads(strip_code_fence(content))
+        if validate(data):
+            stats.increment(stage, "parsed")
+            return data
+    except json.JSONDecodeError:
+        pass
+
+    data = parse_json_response(content)
+    if data is not None and validate(data):
+        stats.increment(stage, "repaired")
+        return data
+
+    if content and content.strip():
+        stats.increment(stage, "retried")
+        try:
+            response = await client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": "あなたは壊れたJSONを修正するツールです。修正したJSONのみを出力してください。"},
+                    {"role": "user", "content": f"""以下のテキストを、指定された形式の有効なJSONに修正してください。内容は変更しないでください。
+
+形式:
+{format_hint}
+
+テキスト:
+{content}
+"""}
+                ],
+                temperature=0.0,
+                max_tokens=estimate_tokens(content) + 100,
+                **structured_output_kwargs(mode or settings.STRUCTURED_OUTPUT)
+            )
+            data = parse_json_response(response_payload(response))
+            if data is not None and validate(data):
+                stats.increment(stage, "recovered")
+                return data
+        except Exception as e:
+            logger.error(f"Error repairing {stage} response: {e}")
+
+    stats.increment(stage, "failed")
+    logger.error(f"Failed to parse {stage} response: {(content or '')[:200]}...")
+    return None
@@ -0,0 +1,265 @@
+import os
+import json
+import logging
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+from pipeline.storage import ProjectArrays
+
+logger = logging.getLogger(__name__)
+
+# 集約した点（ビン）の配列の型
+BIN_DTYPE = np.dtype([
+    ("ix", "<i4"),
+    ("iy", "<i4"),
+    ("cluster", "<i4"),
+    ("count", "<i4"),
+    ("x", "<f4"),
+    ("y", "<f4")
+])
+
+
+class PointPyramid:
+    """散布図の多重解像度ピラミッド
+
+    2D座標をズームレベルごとのグリッドに区切り、セル × クラスター単位で
+    点を集約しておく。レベル z では各軸を 2^z 個のセルに分割する。
+    ズームアウト時は集約したビンを、ズームイン時（または範囲内の点が少ない時）
+    は個々の点を返すことで、コメント数によらず転送量と描画コストを一定に保つ。
+    """
+
+    BINS = "lod_bins"
+    ORDER = "lod_order"
+    CELL_OFFSETS = "lod_cell_offsets"
+    META_FILE = "lod_meta.json"
+
+    def __init__(
+        self,
+        bins: np.ndarray,
+        offsets: List[int],
+        extent: Tuple[float, float, float, float],
+        coords: np.ndarray,
+        labels: np.ndarray,
+        argument_ids: np.ndarray,
+        order: Optional[np.ndarray] = None,
+        cell_offsets: Optional[np.ndarray] = None
+    ):
+        self.bins = bins
+        self.offsets = offsets
+        self.extent = extent
+        self.coords = coords
+        self.labels = labels
+        self.argument_ids = argument_ids
+        if order is None or cell_offsets is None:
+            # 点の並び順を保存していない（以前の形式の）ピラミッドは読み込み時に作る
+            order, cell_offsets = self._sort_by_cell(np.asarray(coords, dtype=np.float64), extent, 2 ** self.max_level)
+        self.order = order
+        self.cell_offsets = cell_offsets
+
+    @property
+    def max_level(self) -> int:
+        return len(self.offsets) - 2
+
+    @classmethod
+    def build(cls, output_dir: str, max_level: int = 8) -> None:
+        """ピラミッドを構築して保存"""
+        store = ProjectArrays(output_dir)
+        coords = np.asarray(store.coords, dtype=np.float64)
+        labels = np.asarray(store.labels, dtype=np.int64)
+        num_clusters = int(labels.max()) + 1 if len(labels) else 1
+
+        xmin, ymin = coords.min(axis=0) if len(coords) else (0.0, 0.0)
+        xmax, ymax = coords.max(axis=0) if len(coords) else (1.0, 1.0)
+        # 最大値の点が範囲外のセルに入らないように少し広げる
+        pad_x = max(xmax - xmin, 1e-6) * 1e-6
+        pad_y = max(ymax - ymin, 1e-6) * 1e-6
+        extent = (float(xmin), float(ymin), float(xmax + pad_x), float(ymax + pad_y))
+
+        levels = []
+        offsets = [0]
+        for level in range(max_level + 1):
+            levels.append(cls._aggregate(coords, labels, num_clusters, extent, 2 ** level))
+            offsets.append(offsets[-1] + len(levels[-1]))
+
+        store.save(cls.BINS, np.concatenate(levels))
+        order, cell_offsets = cls._sort_by_cell(coords, extent, 2 ** max_level)
+        store.save(cls.ORDER, order)
+        store.save(cls.CELL_OFFSETS, cell_offsets)
+        with open(os.path.join(output_dir, cls.META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"extent": extent, "offsets": offsets}, f)
+
+        logger.info(f"Built point pyramid with {max_level + 1} levels ({offsets[-1]} bins)")
+
+    @staticmethod
+    def _cell_indices(coords: np.ndarray, extent: Tuple[float, float, float, float], grid: int) -> Tuple[np.ndarray, np.ndarray]:
+        """各点が入るセルの (ix, iy)"""
+        xmin, ymin, xmax, ymax = extent
+        ix = np.clip(((coords[:, 0] - xmin) / (xmax - xmin) * grid).astype(np.int64), 0, grid - 1)
+        iy = np.clip(((coords[:, 1] - ymin) / (ymax - ymin) * grid).astype(np.int64), 0, grid - 1)
+        return ix, iy
+
+    @classmethod
+    def _sort_by_cell(cls, coords: np.ndarray, extent: Tuple[float, float, float, float], grid: int) -> Tuple[np.ndarray, np.ndarray]:
+        """最も細かいレベルのセル順（行優先）に並べた行番号と、セルごとの開始位置
+
+        同じ行（iy）の連続するセルの点は order 上でも連続するため、表示範囲の点は
+        行ごとに1つの範囲として取り出せる（全点を走査しなくてよい）。
+        """
+        ix, iy = cls._cell_indices(coords, extent, grid)
+        cells = iy * grid + ix
+        order = np.argsort(cells, kind="stable").astype(np.int32)
+        cell_offsets = np.concatenate([[0], np.cumsum(np.bincount(cells, minlength=grid * grid))]).astype(np.int64)
+        return order, cell_offsets
+
+    @staticmethod
+    def _aggregate(
+        coords: np.ndarray,
+        labels: np.ndarray,
+        num_clusters: int,
+        extent: Tuple[float, float, float, float],
+        grid: int
+    ) -> np.ndarray:
+        """1レベル分のビンを集計"""
+        ix, iy = PointPyramid._cell_indices(coords, extent, grid)
+
+        keys = (iy * grid + ix) * num_clusters + labels
+        unique_keys, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        inverse = inverse.ravel()
+
+        bins = np.empty(len(unique_keys), dtype=BIN_DTYPE)
+        cells, bins["cluster"] = np.divmod(unique_keys, num_clusters)
+        bins["iy"], bins["ix"] = np.divmod(cells, grid)
+        bins["count"] = counts
+        bins["x"] = np.bincount(inverse, weights=coords[:, 0]) / counts
+        bins["y"] = np.bincount(inverse, weights=coords[:, 1]) / counts
+        return bins
+
+    @classmethod
+    def load(cls, output_dir: str) -> "PointPyramid":
+        """保存済みのピラミッドを開く"""
+        store = ProjectArrays(output_dir)
+        with open(os.path.join(output_dir, cls.META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        args_df = pd.read_csv(os.path.join(output_dir, "args.csv"), usecols=["argument_id"], dtype=str)
+        return cls(
+            store.load(cls.BINS),
+            meta["offsets"],
+            tuple(meta["extent"]),
+            store.coords,
+            store.labels,
+            args_df["argument_id"].to_numpy(dtype=object),
+            store.load(cls.ORDER),
+            store.load(cls.CELL_OFFSETS)
+        )
+
+    def _level_bins(self, level: int, bbox: Tuple[float, float, float, float]) -> np.ndarray:
+        """指定レベルのビンのうち、セルが bbox と重なるものを取得"""
+        bins = self.bins[self.offsets[level]:self.offsets[level + 1]]
+        xmin, ymin, xmax, ymax = self.extent
+        grid = 2 ** level
+        cell_w = (xmax - xmin) / grid
+        cell_h = (ymax - ymin) / grid
+        lo_x = xmin + bins["ix"] * cell_w
+        lo_y = ymin + bins["iy"] * cell_h
+        mask = (lo_x <= bbox[2]) & (lo_x + cell_w >= bbox[0]) & (lo_y <= bbox[3]) & (lo_y + cell_h >= bbox[1])
+        return bins[mask]
+
+    def _points_in_bbox(self, bbox: Tuple[float, float, float, float]) -> Tuple[int, np.ndarray, List[Tuple[int, int]]]:
+        """bbox 内の点の数を数える
+
+        最も細かいレベルのセルのうち bbox の内側にあるセルは点の数だけを数え、
+        境界のセルの点のみ座標で判定するため、走査するのは境界付近の点だけで済む。
+
+        Returns:
+            (点の数, 境界のセルのうち bbox 内の行番号, 内側のセルの点の order 上の範囲)
+        """
+        empty = np.empty(0, dtype=np.int64)
+        xmin, ymin, xmax, ymax = self.extent
+        if bbox[2] < xmin or bbox[0] > xmax or bbox[3] < ymin or bbox[1] > ymax:
+            return 0, empty, []
+
+        grid = 2 ** self.max_level
+        corners = np.array([[bbox[0], bbox[1]], [bbox[2], bbox[3]]], dtype=np.float64)
+        (ix0, ix1), (iy0, iy1) = self._cell_indices(corners, self.extent, grid)
+
+        def span(iy: int, start: int, end: int) -> Tuple[int, int]:
+            return int(self.cell_offsets[iy * grid + start]), int(self.cell_offsets[iy * grid + end + 1])
+
+        edge_spans = []
+        inner_spans = []
+        for iy in range(int(iy0), int(iy1) + 1):
+            if iy in (iy0, iy1) or ix1 - ix0 < 2:
+                edge_spans.append(span(iy, ix0, ix1))
+            else:
+                edge_spans.append(span(iy, ix0, ix0))
+                edge_spans.append(span(iy, ix1, ix1))
+                inner_spans.append(span(iy, ix0 + 1, ix1 - 1))
+
+        edge_rows = np.sort(np.concatenate([empty] + [self.order[lo:hi] for lo, hi in edge_spans]).astype(np.int64))
+        edge_coords = np.asarray(self.coords[edge_rows]).reshape(-1, 2)
+        edge_rows = edge_rows[
+            (edge_coords[:, 0] >= bbox[0]) & (edge_coords[:, 0] <= bbox[2])
+            & (edge_coords[:, 1] >= bbox[1]) & (edge_coords[:, 1] <= bbox[3])
+        ]
+        total = len(edge_rows) + sum(hi - lo for lo, hi in inner_spans)
+        return int(total), edge_rows, inner_spans
+
+    def query(
+        self,
+        bbox: Optional[Tuple[float, float, float, float]] = None,
+        zoom: int = 0,
+        max_items: int = 5000
+    ) -> Dict[str, Any]:
+        """表示範囲とズームレベルに応じた点またはビンを返す
+
+        範囲内の点が max_items 以下、またはズームが最大レベルを超える場合は個々の点を返す。
+        それ以外はビンを返し、ビン数が max_items を超える場合はより粗いレベルに下げる。
+        total はどちらの場合も bbox 内の点の数（ビンは bbox と重なるセルのものを返すため、
+        ビンの count の合計は bbox 外の点を含むことがある）。
+        """
+        bbox = tuple(bbox) if bbox else self.extent
+        total, edge_rows, inner_spans = self._points_in_bbox(bbox)
+
+        if total <= max_items or zoom > self.max_level:
+            rows = np.sort(np.concatenate([edge_rows] + [self.order[lo:hi] for lo, hi in inner_spans]).astype(np.int64))
+            rows = rows[:max_items]
+            x = self.coords[:, 0]
+            y = self.coords[:, 1]
+            return {
+                "mode": "points",
+                "zoom": zoom,
+                "total": total,
+                "truncated": total > max_items,
+                "points": [
+                    {"argument_id": argument_id, "x": px, "y": py, "cluster_id": cluster_id}
+                    for argument_id, px, py, cluster_id in zip(
+                        self.argument_ids[rows],
+                        x[rows].tolist(),
+                        y[rows].tolist(),
+                        self.labels[rows].tolist()
+                    )
+                ]
+            }
+
+        level = max(0, min(zoom, self.max_level))
+        bins = self._level_bins(level, bbox)
+        while len(bins) > max_items and level > 0:
+            level -= 1
+            bins = self._level_bins(level, bbox)
+
+        return {
+            "mode": "bins",
+            "zoom": level,
+            "total": total,
+            "truncated": False,
+            "bins": [
+                {"x": bx, "y": by, "count": count, "cluster_id": cluster_id}
+                for bx, by, count, cluster_id in zip(
+                    bins["x"].tolist(),
+                    bins["y"].tolist(),
+                    bins["count"].tolist(),
+                    bins["cluster"].tolist()
+                )
+            ]
+        }
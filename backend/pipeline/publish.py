@@ -0,0 +1,195 @@
+import os
+import io
+import gzip
+import json
+import shutil
+import uuid
+import hashlib
+import logging
+from typing import List, Dict, Any, Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# バンドルの形式を変えた場合に上げる（ハッシュに含め、既存のバンドルを作り直させる）
+BUNDLE_VERSION = 1
+
+
+class ReportPublisher:
+    """完成したレポートを、nginx から直接配信できる静的バンドルとして書き出す
+
+    バンドルは result.json の内容のハッシュをディレクトリ名とし、一度書き出したら
+    変更しない（長期間キャッシュできる）。result.json が変わらなければ作り直さない。
+
+        {public_dir}/{project_id}/latest.json          最新のバンドルの場所（キャッシュしない）
+        {public_dir}/{project_id}/{hash}/manifest.json.gz
+        {public_dir}/{project_id}/{hash}/overview.json.gz            クラスターの概要と要点
+        {public_dir}/{project_id}/{hash}/clusters/{cluster_id}.json.gz  クラスターの議論
+        {public_dir}/{project_id}/{hash}/locales/{locale}/...        翻訳版（overview と clusters）
+        {public_dir}/{project_id}/{hash}/points/coords.f32           散布図の座標（x, y の順）
+        {public_dir}/{project_id}/{hash}/points/clusters.i32         各点のクラスターID
+
+    JSONは gzip 圧縮したもののみ書き出し、nginx の gzip_static / gunzip で配信する。
+    点の配列はクラスターの並び順・各クラスター内の議論の並び順と一致し、
+    manifest の offset / count でクラスターごとの範囲を示す。
+    """
+
+    MANIFEST = "manifest.json"
+    LATEST = "latest.json"
+
+    def __init__(self, public_dir: str, url_prefix: str = "/share"):
+        self.public_dir = public_dir
+        self.url_prefix = url_prefix.rstrip("/")
+
+    def publish(self, project_id: str, output_dir: str) -> Dict[str, Any]:
+        """バンドルを書き出し、最新のバンドルの場所を返す（内容が同じなら書き出さない）"""
+        result_path = os.path.join(output_dir, "result.json")
+        with open(result_path, "rb") as f:
+            raw = f.read()
+        content_hash = self._content_hash(raw)
+
+        project_dir = os.path.join(self.public_dir, project_id)
+        bundle_dir = os.path.join(project_dir, content_hash)
+        previous = self.latest(project_id)
+
+        created = not os.path.exists(os.path.join(bundle_dir, self.MANIFEST + ".gz"))
+        if created:
+            self._write_bundle(json.loads(raw), project_dir, content_hash)
+            logger.info(f"Published share bundle {content_hash} for project {project_id}")
+
+        latest = {
+            "hash": content_hash,
+            "manifest": f"{self.url_prefix}/{project_id}/{content_hash}/{self.MANIFEST}",
+            "version": BUNDLE_VERSION
+        }
+        self._write_atomic(os.path.join(project_dir, self.LATEST), json.dumps(latest).encode("utf-8"))
+
+        # 直前のバンドルは、古い manifest を読み込み済みの閲覧者のために残す
+        keep = {content_hash, previous["hash"] if previous else None}
+        self._prune(project_dir, keep)
+
+        return {**latest, "created": created}
+
+    def latest(self, project_id: str) -> Optional[Dict[str, Any]]:
+        """最新のバンドルの場所（未公開の場合は None）"""
+        path = os.path.join(self.public_dir, project_id, self.LATEST)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def remove(self, project_id: str) -> None:
+        """プロジェクトのバンドルをすべて削除"""
+        shutil.rmtree(os.path.join(self.public_dir, project_id), ignore_errors=True)
+
+    @staticmethod
+    def _content_hash(raw: bytes) -> str:
+        digest = hashlib.sha256(f"bundle-v{BUNDLE_VERSION}\n".encode("utf-8"))
+        digest.update(raw)
+        return digest.hexdigest()[:20]
+
+    def _write_bundle(self, report: Dict[str, Any], project_dir: str, content_hash: str) -> None:
+        """一時ディレクトリに書き出してから名前を変える（配信中に書きかけのバンドルが見えないように）"""
+        os.makedirs(project_dir, exist_ok=True)
+        staging_dir = os.path.join(project_dir, f".{content_hash}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            files: Dict[str, int] = {}
+            clusters = report.get("clusters", [])
+
+            # 散布図の点（クラスター順・クラスター内の議論順）
+            ranges = []
+            coords = []
+            cluster_ids = []
+            for cluster in clusters:
+                arguments = cluster.get("arguments", [])
+                ranges.append({"cluster_id": cluster["cluster_id"], "offset": len(coords), "count": len(arguments)})
+                coords.extend((arg.get("x", np.nan), arg.get("y", np.nan)) for arg in arguments)
+                cluster_ids.extend([cluster["cluster_id"]] * len(arguments))
+            coords = np.asarray(coords, dtype="<f4").reshape(-1, 2)
+            files["points/coords.f32"] = self._write_file(staging_dir, "points/coords.f32", coords.tobytes())
+            files["points/clusters.i32"] = self._write_file(
+                staging_dir, "points/clusters.i32", np.asarray(cluster_ids, dtype="<i4").tobytes()
+            )
+
+            # 原文と翻訳版の概要・クラスターごとの議論
+            translations = report.get("translations") or {}
+            locales = {"default": self._write_locale(staging_dir, "", report, files)}
+            if translations:
+                from pipeline.translation import localize_report
+                for locale, table in translations.items():
+                    locales[locale] = self._write_locale(
+                        staging_dir, f"locales/{locale}/", localize_report(report, table), files
+                    )
+
+            finite = coords[np.isfinite(coords).all(axis=1)]
+            manifest = {
+                "version": BUNDLE_VERSION,
+                "hash": content_hash,
+                "project_id": report.get("project_id"),
+                "created_at": (report.get("metadata") or {}).get("created_at"),
+                "points": {
+                    "count": len(coords),
+                    "coords": {"path": "points/coords.f32", "dtype": "float32", "shape": [len(coords), 2]},
+                    "clusters": {"path": "points/clusters.i32", "dtype": "int32", "shape": [len(coords)]},
+                    "extent": finite.min(axis=0).tolist() + finite.max(axis=0).tolist() if len(finite) else None,
+                    "ranges": ranges
+                },
+                "locales": locales,
+                "files": files
+            }
+            self._write_json(staging_dir, self.MANIFEST, manifest)
+
+            try:
+                os.rename(staging_dir, os.path.join(project_dir, content_hash))
+            except OSError:
+                # 同じ内容のバンドルが並行して書き出された場合はそちらを使う
+                if not os.path.isdir(os.path.join(project_dir, content_hash)):
+                    raise
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def _write_locale(self, staging_dir: str, prefix: str, report: Dict[str, Any], files: Dict[str, int]) -> Dict[str, Any]:
+        """1言語分の概要とクラスターの分割ファイルを書き出し、それぞれのパスを返す"""
+        overview = {k: v for k, v in report.items() if k not in ("clusters", "translations", "metadata")}
+        overview["clusters"] = [{k: v for k, v in c.items() if k != "arguments"} for c in report.get("clusters", [])]
+        overview_path = f"{prefix}overview.json"
+        files[overview_path] = self._write_json(staging_dir, overview_path, overview)
+
+        shards = {}
+        for cluster in report.get("clusters", []):
+            path = f"{prefix}clusters/{cluster['cluster_id']}.json"
+            files[path] = self._write_json(
+                staging_dir, path, {"cluster_id": cluster["cluster_id"], "arguments": cluster.get("arguments", [])}
+            )
+            shards[str(cluster["cluster_id"])] = path
+        return {"overview": overview_path, "clusters": shards}
+
+    def _write_json(self, staging_dir: str, path: str, data: Any) -> int:
+        """gzip 圧縮したJSONを書き出す（mtime を固定し、同じ内容なら同じバイト列にする）"""
+        buffer = io.BytesIO()
+        with gzip.GzipFile(filename="", mode="wb", fileobj=buffer, compresslevel=9, mtime=0) as f:
+            f.write(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        return self._write_file(staging_dir, path + ".gz", buffer.getvalue())
+
+    @staticmethod
+    def _write_file(staging_dir: str, path: str, data: bytes) -> int:
+        full_path = os.path.join(staging_dir, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "wb") as f:
+            f.write(data)
+        return len(data)
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes) -> None:
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _prune(project_dir: str, keep: set) -> None:
+        """残すもの以外のバンドルを削除（書き出し中の一時ディレクトリは残す）"""
+        for name in os.listdir(project_dir):
+            path = os.path.join(project_dir, name)
+            if os.path.isdir(path) and not name.startswith(".") and name not in keep:
+                shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,117 @@
+import re
+import unicodedata
+from collections import Counter
+from typing import List, Dict, Any, Optional
+
+from pipeline.llm_utils import estimate_tokens
+
+# 記号・空白を除いた後、これらの語句だけからなるコメントは意見を含まないものとして扱う
+# （「特になし」「わかりません」などの回答や、「ありがとうございました。よろしくお願いします」などの挨拶）
+# 語句は先頭から1つずつ照合する（全体を (...)+ で照合すると、一致しない長い入力でバックトラックが指数的に増える）。
+# 長い語句が短い語句の途中で切れないよう、前方一致する候補は長い方を先に並べる
+_TRIVIAL_PHRASE = re.compile(
+    r"(?:とくに|特に)?(?:意見|要望|コメント|質問)?(?:は)?(?:とくに|特に)?"
+    r"(?:なし|無し|ない|無い|ありません|ございません|ありませんでした)(?:です)?"
+    r"|わからない|分からない|わかりません|分かりません|不明|未記入|未回答|以上(?:です)?|同上"
+    r"|(?:どうも)?(?:ありがとう|有難う|有り難う)(?:ございます|ございました)?"
+    r"|(?:どうぞ)?(?:よろしく|宜しく)(?:お願い|おねがい)?(?:します|いたします|致します|申し上げます)?"
+    r"|お(?:疲れ|つかれ)(?:様|さま)(?:です|でした)?|お世話になって(?:おります|います)"
+    r"|感謝(?:します|しています|いたします|致します)?"
+    r"|nocomments?|nothing|none|nil|na|no|thankyou|thanks?|thx"
+)
+# これより長いコメントは意見を含むものとして扱う（定型の回答・挨拶の組み合わせはこれより短い）
+_TRIVIAL_MAX_CHARS = 40
+_SENTENCE_PATTERN = re.compile(r"[。．.!?！？\n]+")
+_BULLET_PATTERN = re.compile(r"^\s*(?:[・\-*•●○◆■]|\d+[.)．）]|[①-⑳])", re.MULTILINE)
+
+# 経路: skip（抽出しない）、local（LLMを使わずにそのまま議論とする）、fast / strong（LLMで抽出）
+ROUTES = ["skip", "local", "fast", "strong"]
+
+
+def _normalize(text: str) -> str:
+    """全角・半角を揃え、記号・空白を除いて小文字にする"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(ch for ch in text if unicodedata.category(ch)[0] not in "PZSC")
+
+
+def is_trivial_comment(text: str) -> bool:
+    """「特になし」など、意見を含まないコメントかどうか"""
+    normalized = _normalize(text)
+    # 文字（長音記号などの修飾文字を除く）を含まないものは意見を含まない
+    if not any(unicodedata.category(ch) in ("Lu", "Ll", "Lt", "Lo") for ch in normalized):
+        return True
+    if len(normalized) > _TRIVIAL_MAX_CHARS:
+        return False
+    position = 0
+    while position < len(normalized):
+        match = _TRIVIAL_PHRASE.match(normalized, position)
+        if not match or match.end() == position:
+            return False
+        position = match.end()
+    return True
+
+
+def count_sentences(text: str) -> int:
+    """文と箇条書きの項目の数（コメントの複雑さの目安）"""
+    sentences = [s for s in _SENTENCE_PATTERN.split(text) if s.strip()]
+    return max(len(sentences), len(_BULLET_PATTERN.findall(text)))
+
+
+def estimate_max_tokens(text: str, cap: int) -> int:
+    """コメントの長さに応じた出力トークン数の上限
+
+    抽出結果はコメントの言い換えと要約を含むため、入力の約1.5倍 + JSONの枠の分を見込む。
+    """
+    return min(cap, max(200, int(estimate_tokens(text) * 1.5) + 100))
+
+
+def route_comment(
+    text: str,
+    fast_model: str,
+    strong_model: Optional[str],
+    local_max_chars: int,
+    strong_min_chars: int,
+    strong_min_sentences: int,
+    max_tokens_cap: int
+) -> Dict[str, Any]:
+    """コメントの抽出方法を決める
+
+    - 空・意見を含まないコメントは skip
+    - 短い1文のコメントは local（コメントをそのまま議論・要約とする）
+    - 長い・文の多いコメントは strong_model、それ以外は fast_model
+
+    Returns:
+        route / model / max_tokens / reason / chars を含む辞書
+    """
+    text = text.strip()
+    decision = {"route": "fast", "model": fast_model, "max_tokens": 0, "reason": "default", "chars": len(text)}
+
+    if not text:
+        decision.update(route="skip", model=None, reason="empty")
+        return decision
+    if is_trivial_comment(text):
+        decision.update(route="skip", model=None, reason="contentless")
+        return decision
+
+    sentences = count_sentences(text)
+    if len(text) <= local_max_chars and sentences <= 1:
+        decision.update(route="local", model=None, reason="short")
+        return decision
+
+    decision["max_tokens"] = estimate_max_tokens(text, max_tokens_cap)
+    if strong_model and len(text) >= strong_min_chars:
+        decision.update(route="strong", model=strong_model, reason="long")
+    elif strong_model and sentences >= strong_min_sentences:
+        decision.update(route="strong", model=strong_model, reason="complex")
+    return decision
+
+
+def summarize_routing(decisions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """経路・モデルごとの件数（メタデータ用）"""
+    routes = Counter(d["route"] for d in decisions)
+    return {
+        "comments": len(decisions),
+        "routes": {route: routes.get(route, 0) for route in ROUTES},
+        "models": dict(Counter(d["model"] for d in decisions if d["model"])),
+        "reasons": dict(Counter(d["reason"] for d in decisions))
+    }
@@ -0,0 +1,73 @@
+import logging
+from typing import Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def select_representatives(
+    embeddings: np.ndarray,
+    k: int,
+    weights: Optional[np.ndarray] = None,
+    diversity: float = 0.3,
+    max_candidates: int = 2000,
+    seed: int = 42
+) -> np.ndarray:
+    """クラスターを代表する議論を選ぶ（最大限界関連性 / MMR）
+
+    重心に近い議論を優先しつつ、既に選んだ議論と似すぎたものは避けることで、
+    少ないサンプルでもクラスターの中心と広がりの両方をカバーする。
+    重み（重複数や賛成票数）が大きい議論ほど選ばれやすい。
+    同じ入力・同じシードに対しては常に同じ結果を返す。
+
+    Args:
+        embeddings: クラスター内の議論の埋め込み
+        k: 選ぶ件数
+        weights: 各議論の重み（省略時は均等）
+        diversity: 多様性の重視度（0: 重心への近さのみ, 1: 多様性のみ）
+        max_candidates: 候補数の上限（大きなクラスターの計算量を抑える）
+        seed: 候補の間引きに使う乱数シード
+
+    Returns:
+        選ばれた議論の行番号（embeddings 内の位置、選択順）
+    """
+    n = len(embeddings)
+    if n <= k:
+        return np.arange(n)
+
+    weights = np.ones(n) if weights is None else np.asarray(weights, dtype=np.float64)
+    vectors = _normalize_rows(embeddings)
+    centroid = np.average(vectors, axis=0, weights=weights)
+    centroid /= max(float(np.linalg.norm(centroid)), 1e-12)
+
+    # 重心への近さを重みで補正（票数が多いほど代表として扱う）
+    relevance = vectors @ centroid + 0.1 * np.log1p(weights)
+
+    candidates = np.arange(n)
+    if n > max_candidates:
+        # 重心に近いものを半分、残りはシード付きの乱数で選び、外れ側の意見も候補に残す
+        top = np.argsort(-relevance, kind="stable")[:max_candidates // 2]
+        rest = np.setdiff1d(candidates, top)
+        rng = np.random.default_rng(seed)
+        candidates = np.concatenate([top, rng.choice(rest, max_candidates - len(top), replace=False)])
+        candidates.sort()
+
+    cand_vectors = vectors[candidates]
+    cand_relevance = relevance[candidates]
+
+    selected = [int(np.argmax(cand_relevance))]
+    max_sim = cand_vectors @ cand_vectors[selected[0]]
+    for _ in range(k - 1):
+        score = (1 - diversity) * cand_relevance - diversity * max_sim
+        score[selected] = -np.inf
+        best = int(np.argmax(score))
+        selected.append(best)
+        max_sim = np.maximum(max_sim, cand_vectors @ cand_vectors[best])
+
+    return candidates[selected]
@@ -0,0 +1,315 @@
+import os
+import json
+import logging
+import unicodedata
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+from pipeline.storage import ProjectArrays
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_text(text: str) -> str:
+    """全角・半角や大文字・小文字の揺れを吸収"""
+    return unicodedata.normalize("NFKC", str(text)).lower()
+
+
+def analyze_ngrams(text: str) -> List[str]:
+    """キーワード索引用のトークン化（文字1-gram/2-gram + 英数字の単語）
+
+    日本語は分かち書きされていないため、形態素解析の代わりに文字n-gramを使う。
+    """
+    text = _normalize_text(text)
+    tokens = []
+    for word in text.split():
+        tokens.extend(word)
+        tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        if word.isascii() and len(word) > 2:
+            tokens.append(word)
+    return tokens
+
+
+def _is_weak_term(term: str) -> bool:
+    """ほとんどの文書に現れ、それだけでは内容を表さない語（仮名・記号・英字の1文字）
+
+    漢字の1文字（「駅」「木」など）は内容を表すため含めない。
+    """
+    if len(term) != 1:
+        return False
+    return not (term.isdigit() or unicodedata.name(term, "").startswith("CJK UNIFIED IDEOGRAPH"))
+
+
+class VectorIndex:
+    """埋め込みベクトルのコサイン類似度検索
+
+    小規模なプロジェクトは総当たり、大規模なプロジェクトは転置ファイル（IVF）で
+    候補を絞り込んでから検索する。ベクトル本体はクラスタリング時に保存した
+    embeddings.npy をメモリマップで共有し、複製は持たない。
+    """
+
+    NORMS = "search_norms"
+    IVF_CENTROIDS = "search_ivf_centroids"
+    IVF_ORDER = "search_ivf_order"
+    IVF_OFFSETS = "search_ivf_offsets"
+
+    def __init__(
+        self,
+        vectors: np.ndarray,
+        norms: np.ndarray,
+        centroids: Optional[np.ndarray] = None,
+        order: Optional[np.ndarray] = None,
+        offsets: Optional[np.ndarray] = None,
+        nprobe: int = 8
+    ):
+        self.vectors = vectors
+        self.norms = norms
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.nprobe = nprobe
+
+    @classmethod
+    def build(cls, store: ProjectArrays, brute_force_limit: int, nprobe: int = 8) -> "VectorIndex":
+        """索引を構築して保存"""
+        vectors = store.embeddings
+        norms = np.linalg.norm(vectors, axis=1).astype(np.float32)
+        norms[norms == 0] = 1.0
+        norms = store.save(cls.NORMS, norms)
+
+        if len(vectors) <= brute_force_limit:
+            return cls(vectors, norms, nprobe=nprobe)
+
+        from sklearn.cluster import MiniBatchKMeans
+
+        # IVF: ベクトルを粗いクラスターに分け、近いクラスターのみ走査する
+        nlist = int(np.sqrt(len(vectors)))
+        unit = vectors / norms[:, None]
+        kmeans = MiniBatchKMeans(n_clusters=nlist, random_state=42, n_init=3, batch_size=4096)
+        assign = kmeans.fit_predict(unit)
+        centroids = kmeans.cluster_centers_.astype(np.float32)
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        order = np.argsort(assign, kind="stable").astype(np.int32)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))]).astype(np.int64)
+
+        logger.info(f"Built IVF index with {nlist} lists for {len(vectors)} vectors")
+        return cls(
+            vectors,
+            norms,
+            store.save(cls.IVF_CENTROIDS, centroids),
+            store.save(cls.IVF_ORDER, order),
+            store.save(cls.IVF_OFFSETS, offsets),
+            nprobe=nprobe
+        )
+
+    @classmethod
+    def load(cls, store: ProjectArrays, nprobe: int = 8) -> "VectorIndex":
+        """保存済みの索引をメモリマップで開く"""
+        return cls(
+            store.embeddings,
+            store.load(cls.NORMS),
+            store.load(cls.IVF_CENTROIDS),
+            store.load(cls.IVF_ORDER),
+            store.load(cls.IVF_OFFSETS),
+            nprobe=nprobe
+        )
+
+    def _candidates(self, query: np.ndarray) -> Optional[np.ndarray]:
+        if self.centroids is None:
+            return None
+        nprobe = min(self.nprobe, len(self.centroids))
+        lists = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in lists])
+
+    def query(self, vector: np.ndarray, k: int = 10, exclude: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """ベクトルに近い上位k件の (行番号, 類似度) を返す"""
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+        candidates = self._candidates(query)
+        if candidates is None:
+            scores = (self.vectors @ query) / self.norms
+            candidates = np.arange(len(scores))
+        else:
+            scores = (self.vectors[candidates] @ query) / self.norms[candidates]
+
+        if exclude is not None and len(exclude):
+            mask = ~np.isin(candidates, exclude)
+            candidates, scores = candidates[mask], scores[mask]
+
+        k = min(k, len(scores))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return candidates[top], scores[top]
+
+
+class KeywordIndex:
+    """文字n-gramの転置索引（CSC形式のポスティングリスト）"""
+
+    VOCAB_FILE = "search_vocab.json"
+    IDF = "search_idf"
+    INDPTR = "search_postings_indptr"
+    INDICES = "search_postings_indices"
+
+    def __init__(self, vocab: Dict[str, int], idf: np.ndarray, indptr: np.ndarray, indices: np.ndarray, num_docs: int):
+        self.vocab = vocab
+        self.idf = idf
+        self.indptr = indptr
+        self.indices = indices
+        self.num_docs = num_docs
+
+    @classmethod
+    def build(cls, store: ProjectArrays, texts: List[str]) -> "KeywordIndex":
+        """索引を構築して保存"""
+        from sklearn.feature_extraction.text import CountVectorizer
+
+        vectorizer = CountVectorizer(analyzer=analyze_ngrams, binary=True, dtype=np.int8)
+        matrix = vectorizer.fit_transform(texts).tocsc()
+        vocab = {term: int(col) for term, col in vectorizer.vocabulary_.items()}
+
+        df = np.diff(matrix.indptr)
+        idf = np.log((1 + len(texts)) / (1 + df)).astype(np.float32) + 1.0
+
+        with open(os.path.join(store.output_dir, cls.VOCAB_FILE), "w", encoding="utf-8") as f:
+            json.dump(vocab, f, ensure_ascii=False)
+
+        return cls(
+            vocab,
+            store.save(cls.IDF, idf),
+            store.save(cls.INDPTR, matrix.indptr.astype(np.int64)),
+            store.save(cls.INDICES, matrix.indices.astype(np.int32)),
+            len(texts)
+        )
+
+    @classmethod
+    def load(cls, store: ProjectArrays, num_docs: int) -> "KeywordIndex":
+        """保存済みの索引を開く"""
+        with open(os.path.join(store.output_dir, cls.VOCAB_FILE), "r", encoding="utf-8") as f:
+            vocab = json.load(f)
+        return cls(vocab, store.load(cls.IDF), store.load(cls.INDPTR), store.load(cls.INDICES), num_docs)
+
+    # 仮名・記号などの1文字の語の重み（IDFに掛ける）
+    WEAK_TERM_WEIGHT = 0.1
+
+    def query(self, text: str, k: int = 50) -> Tuple[np.ndarray, np.ndarray]:
+        """クエリのn-gramをIDFで重み付けして照合し、上位k件の (行番号, スコア) を返す
+
+        スコアはクエリ全体のIDFの合計で割る（索引にない語は最大のIDFとして数える）ため、
+        クエリの一部の語しか含まない文書のスコアは低くなる。仮名1文字などの語は重みを下げ、
+        クエリに内容を表す語がある場合は、それを1つも含まない文書をヒットにしない。
+        """
+        terms = set(analyze_ngrams(text))
+        if not terms:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        max_idf = float(np.log(1 + self.num_docs)) + 1.0
+        total = 0.0
+        weights_by_col = {}
+        strong_cols = set()
+        for term in terms:
+            weight = self.WEAK_TERM_WEIGHT if _is_weak_term(term) else 1.0
+            col = self.vocab.get(term)
+            total += weight * (float(self.idf[col]) if col is not None else max_idf)
+            if col is not None:
+                weights_by_col[col] = weight * float(self.idf[col])
+                if weight == 1.0:
+                    strong_cols.add(col)
+        if not weights_by_col:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        cols = sorted(weights_by_col)
+        postings = [self.indices[self.indptr[c]:self.indptr[c + 1]] for c in cols]
+        weights = [np.full(len(p), weights_by_col[c], dtype=np.float32) for c, p in zip(cols, postings)]
+        scores = np.bincount(np.concatenate(postings), weights=np.concatenate(weights), minlength=self.num_docs)
+        scores /= total
+
+        if any(not _is_weak_term(t) for t in terms):
+            # 内容を表す語を1つ以上含む文書のみ（仮名1文字だけの一致は除く）
+            strong = [self.indices[self.indptr[c]:self.indptr[c + 1]] for c in sorted(strong_cols)]
+            hits = np.unique(np.concatenate(strong)) if strong else np.empty(0, dtype=np.int64)
+        else:
+            hits = np.flatnonzero(scores)
+
+        k = min(k, len(hits))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return top, scores[top].astype(np.float32)
+
+
+class ProjectSearchIndex:
+    """プロジェクト単位の検索（キーワード検索 + 類似議論検索）"""
+
+    def __init__(self, output_dir: str, vector_index: VectorIndex, keyword_index: KeywordIndex, records: List[Dict[str, Any]]):
+        self.output_dir = output_dir
+        self.vector_index = vector_index
+        self.keyword_index = keyword_index
+        self.records = records
+        self.row_by_id = {str(rec["argument_id"]): i for i, rec in enumerate(records)}
+        self.labels = ProjectArrays(output_dir).labels
+
+    @staticmethod
+    def build(output_dir: str, texts: List[str], brute_force_limit: int) -> None:
+        """run_analysis の最後に索引を構築"""
+        store = ProjectArrays(output_dir)
+        VectorIndex.build(store, brute_force_limit)
+        KeywordIndex.build(store, texts)
+        logger.info(f"Search index built for {len(texts)} arguments")
+
+    @classmethod
+    def load(cls, output_dir: str) -> "ProjectSearchIndex":
+        """保存済みの索引と議論テーブルを読み込む"""
+        store = ProjectArrays(output_dir)
+        args_df = pd.read_csv(os.path.join(output_dir, "args.csv"), dtype=str, keep_default_na=False)
+        records = args_df[["argument_id", "comment_id", "argument", "summary"]].to_dict("records")
+        return cls(output_dir, VectorIndex.load(store), KeywordIndex.load(store, len(records)), records)
+
+    def _hits(self, rows: np.ndarray, scores: np.ndarray) -> List[Dict[str, Any]]:
+        hits = []
+        for row, score in zip(rows.tolist(), scores.tolist()):
+            hit = dict(self.records[row])
+            hit["cluster_id"] = int(self.labels[row]) if self.labels is not None else None
+            hit["score"] = round(float(score), 4)
+            hits.append(hit)
+        return hits
+
+    # expand=True の場合に埋め込みの類似度に掛ける重み（キーワードの最高スコアに対する比）
+    EXPAND_WEIGHT = 0.5
+
+    def search(self, query: str, k: int = 20, expand: bool = False) -> List[Dict[str, Any]]:
+        """キーワードで検索
+
+        expand=True の場合、上位ヒットの埋め込みの重心に近い議論も候補に加え、
+        キーワードのスコアと重心との類似度を足し合わせたスコアで並べ直す
+        （キーワードを含まないが内容の近い議論を拾うため）。
+        """
+        rows, scores = self.keyword_index.query(query, k)
+        if not expand or not len(rows):
+            return self._hits(rows, scores)
+
+        seed = rows[:min(10, len(rows))]
+        centroid = np.asarray(self.vector_index.vectors[np.sort(seed)]).mean(axis=0)
+        near_rows, _ = self.vector_index.query(centroid, k)
+
+        # キーワードのヒットと近傍の議論をまとめ、両方のスコアで並べる
+        candidates = np.union1d(rows, near_rows)
+        keyword_scores = np.zeros(len(candidates), dtype=np.float32)
+        keyword_scores[np.searchsorted(candidates, rows)] = scores
+        unit = centroid / max(float(np.linalg.norm(centroid)), 1e-12)
+        similarity = (np.asarray(self.vector_index.vectors[candidates]) @ unit) / self.vector_index.norms[candidates]
+        combined = (keyword_scores + self.EXPAND_WEIGHT * float(scores[0]) * np.clip(similarity, 0, 1)) / (1 + self.EXPAND_WEIGHT)
+
+        top = np.argsort(-combined, kind="stable")[:k]
+        return self._hits(candidates[top], combined[top])
+
+    def similar(self, argument_id: str, k: int = 10) -> Optional[List[Dict[str, Any]]]:
+        """指定した議論に近い議論を返す（議論が存在しない場合は None）"""
+        row = self.row_by_id.get(argument_id)
+        if row is None:
+            return None
+        rows, scores = self.vector_index.query(self.vector_index.vectors[row], k, exclude=np.array([row]))
+        return self._hits(rows, scores)
@@ -0,0 +1,88 @@
+import logging
+from typing import List, Dict, Any
+import numpy as np
+import pandas as pd
+from pipeline.clustering import group_by_cluster
+
+logger = logging.getLogger(__name__)
+
+
+def vote_columns(args_df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """議論テーブルから賛成・反対票の列を数値配列として取り出す（列がない場合は0）"""
+    columns = {}
+    for name in ["agree", "disagree"]:
+        if name in args_df.columns:
+            values = pd.to_numeric(args_df[name], errors="coerce").fillna(0)
+            columns[name] = np.maximum(values.to_numpy(dtype=np.int64), 0)
+        else:
+            columns[name] = np.zeros(len(args_df), dtype=np.int64)
+    return columns
+
+
+def compute_cluster_stats(args_df: pd.DataFrame, labels: np.ndarray, top_n: int = 5) -> Dict[int, Dict[str, Any]]:
+    """クラスターごとの賛否の集計を計算
+
+    票はコメント単位で付くため、同じコメントから抽出された複数の議論が同じ
+    クラスターに入った場合は1回だけ数える。
+
+    - agree / disagree: 賛成・反対票の合計
+    - consensus: 賛成票の割合（票がない場合は None）
+    - polarization: コメントごとの賛否の割れ具合（0: 全員一致 〜 1: 賛否が半々）の票数加重平均
+    - top_arguments: 賛成票の多い議論のID（最大 top_n 件）
+    """
+    labels = np.asarray(labels)
+    votes = vote_columns(args_df)
+    num_clusters = int(labels.max()) + 1 if len(labels) else 0
+
+    comments = pd.DataFrame({
+        "label": labels,
+        "comment_id": args_df["comment_id"].astype(str).to_numpy(),
+        "agree": votes["agree"],
+        "disagree": votes["disagree"]
+    }).drop_duplicates(["label", "comment_id"])
+
+    comment_labels = comments["label"].to_numpy()
+    agree = comments["agree"].to_numpy(dtype=np.float64)
+    disagree = comments["disagree"].to_numpy(dtype=np.float64)
+    total = agree + disagree
+    split = np.divide(2 * np.minimum(agree, disagree), total, out=np.zeros_like(total), where=total > 0)
+
+    comment_counts = np.bincount(comment_labels, minlength=num_clusters)
+    agree_totals = np.bincount(comment_labels, weights=agree, minlength=num_clusters)
+    disagree_totals = np.bincount(comment_labels, weights=disagree, minlength=num_clusters)
+    vote_totals = agree_totals + disagree_totals
+    split_weighted = np.bincount(comment_labels, weights=split * total, minlength=num_clusters)
+
+    # 賛成票の多い順（同数の場合は反対票の少ない順）に並べた議論
+    order = np.lexsort((votes["disagree"], -votes["agree"], labels))
+    groups = group_by_cluster(labels, order)
+    argument_ids = args_df["argument_id"].to_numpy(dtype=object)
+
+    stats = {}
+    for cluster_id, rows in groups.items():
+        vote_total = int(vote_totals[cluster_id])
+        top_rows = rows[:top_n]
+        stats[cluster_id] = {
+            "comments": int(comment_counts[cluster_id]),
+            "agree": int(agree_totals[cluster_id]),
+            "disagree": int(disagree_totals[cluster_id]),
+            "votes": vote_total,
+            "consensus": round(agree_totals[cluster_id] / vote_total, 4) if vote_total else None,
+            "polarization": round(split_weighted[cluster_id] / vote_total, 4) if vote_total else None,
+            "top_arguments": argument_ids[top_rows[votes["agree"][top_rows] > 0]].tolist()
+        }
+    return stats
+
+
+def sort_cluster_stats(
+    clusters: List[Dict[str, Any]],
+    sort: str = "votes",
+    descending: bool = True,
+    min_votes: int = 0
+) -> List[Dict[str, Any]]:
+    """クラスターの集計を並べ替え・絞り込み（値がないクラスターは末尾）"""
+    filtered = [c for c in clusters if c["stats"]["votes"] >= min_votes]
+    key = (lambda c: c["size"]) if sort == "size" else (lambda c: c["stats"][sort])
+    present = [c for c in filtered if key(c) is not None]
+    missing = [c for c in filtered if key(c) is None]
+    return sorted(present, key=key, reverse=descending) + missing
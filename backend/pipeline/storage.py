@@ -0,0 +1,75 @@
+import os
+import logging
+from typing import Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class ProjectArrays:
+    """プロジェクトごとの数値配列をメモリマップ形式（.npy）で保存・読み込むクラス
+
+    埋め込み・2D座標・クラスター割り当てを一度だけ書き出し、後続の処理や
+    APIハンドラーからは mmap_mode='r' で開くことで、複数のワーカープロセスが
+    同じページをコピーなしで共有できるようにする。
+    """
+
+    EMBEDDINGS = "embeddings"
+    COORDS = "coords"
+    LABELS = "labels"
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+
+    def path(self, name: str) -> str:
+        """配列ファイルのパスを取得"""
+        return os.path.join(self.output_dir, f"{name}.npy")
+
+    def exists(self, name: str) -> bool:
+        """配列ファイルが存在するか確認"""
+        return os.path.exists(self.path(name))
+
+    def create(self, name: str, shape, dtype) -> np.memmap:
+        """書き込み用のメモリマップ配列を作成（チャンク単位で書き込む場合に使用）"""
+        tmp_path = self.path(name) + ".tmp"
+        return np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=tuple(shape))
+
+    def commit(self, name: str, array: np.memmap) -> np.ndarray:
+        """create() で作成した配列を確定し、読み取り専用で開き直す"""
+        array.flush()
+        tmp_path = array.filename
+        del array
+        # 読み込み側が書きかけのファイルを開かないようにアトミックに置き換える
+        os.replace(tmp_path, self.path(name))
+        return self.load(name)
+
+    def discard(self, name: str) -> None:
+        """create() で作成し、確定しなかった書きかけのファイルを削除"""
+        tmp_path = self.path(name) + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    def save(self, name: str, array: np.ndarray, dtype=None) -> np.ndarray:
+        """配列を書き出し、読み取り専用のメモリマップとして返す"""
+        array = np.ascontiguousarray(array, dtype=dtype or array.dtype)
+        out = self.create(name, array.shape, array.dtype)
+        out[...] = array
+        return self.commit(name, out)
+
+    def load(self, name: str) -> Optional[np.ndarray]:
+        """配列を読み取り専用のメモリマップとして開く"""
+        if not self.exists(name):
+            return None
+        return np.load(self.path(name), mmap_mode="r")
+
+    @property
+    def embeddings(self) -> Optional[np.ndarray]:
+        return self.load(self.EMBEDDINGS)
+
+    @property
+    def coords(self) -> Optional[np.ndarray]:
+        return self.load(self.COORDS)
+
+    @property
+    def labels(self) -> Optional[np.ndarray]:
+        return self.load(self.LABELS)
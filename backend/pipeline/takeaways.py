@@ -0,0 +1,167 @@
+import asyncio
+import logging
+from typing import List, Dict, Any, Callable
+from openai import AsyncOpenAI
+from config import settings
+from pipeline.concurrency import GovernedClient
+from pipeline.cache import JsonCache
+from pipeline.llm_utils import estimate_tokens, pack_by_budget, parse_json_response
+
+logger = logging.getLogger(__name__)
+
+class TakeawayGenerator:
+    """クラスターの要約から全体の要点を生成するクラス（map-reduce方式）
+
+    map: ラベリングで得られたクラスターごとのラベル・要約をそのまま使う
+    reduce: トークン予算に収まるまで要約を段階的にまとめ、最後に要点を生成する
+
+    入力はコメント数ではなくクラスター数に比例するため、コメント数が増えても
+    コストは増えない。途中の要約はキャッシュし、再実行時は再利用する。
+    """
+
+    # まとめ処理の段数の上限（これを超えた場合は残りの要約から要点を生成する）
+    MAX_REDUCE_LEVELS = 8
+
+    def __init__(self):
+        self.client = GovernedClient(AsyncOpenAI(api_key=settings.OPENAI_API_KEY))
+        self.cache = JsonCache("takeaways")
+
+    async def generate_takeaways(
+        self,
+        clusters: List[Dict[str, Any]],
+        question: str,
+        model: str = "gpt-3.5-turbo",
+        fan_in: int = 50,
+        token_budget: int = 3000,
+        max_takeaways: int = 5
+    ) -> List[str]:
+        """全体の要点を生成（失敗した場合は空リスト）
+
+        Args:
+            clusters: ラベル付きのクラスターデータ
+            question: 市民への質問内容
+            fan_in: 1回のまとめ処理に含める要約の最大数
+            token_budget: 1リクエストあたりの入力トークン予算
+            max_takeaways: 生成する要点の最大数
+        """
+        logger.info(f"Generating takeaways from {len(clusters)} cluster summaries")
+
+        total = sum(c['size'] for c in clusters)
+        notes = [
+            self._format_cluster_note(cluster, total)
+            for cluster in sorted(clusters, key=lambda c: -c['size'])
+        ]
+
+        fan_in = max(2, fan_in)
+        
+        try:
+            level = 0
+            while True:
+                batches = pack_by_budget(notes, [estimate_tokens(n) for n in notes], token_budget, fan_in)
+                if len(batches) == 1:
+                    break
+                if level >= self.MAX_REDUCE_LEVELS:
+                    logger.warning(f"Reached {level} reduce levels; finalizing with {len(notes)} notes over budget")
+                    break
+                if len(batches) >= len(notes):
+                    # 予算が小さすぎて要約が1件ずつのバッチになる（件数が減らない）場合は、
+                    # 予算を超えても2件ずつまとめて必ず件数を減らす
+                    logger.warning(f"Token budget {token_budget} fits only one note per batch; merging pairwise")
+                    batches = [notes[i:i + 2] for i in range(0, len(notes), 2)]
+                level += 1
+                logger.info(f"Reducing {len(notes)} notes into {len(batches)} partial summaries (level {level})")
+                notes = await asyncio.gather(*[
+                    self._reduce(batch, question, model) for batch in batches
+                ])
+
+            takeaways = await self._finalize(notes, question, model, max_takeaways)
+        except Exception as e:
+            logger.error(f"Error generating takeaways: {e}")
+            return []
+
+        logger.info(f"Generated {len(takeaways)} takeaways")
+        return takeaways
+
+    def _format_cluster_note(self, cluster: Dict[str, Any], total: int) -> str:
+        """クラスター1件分の要約情報"""
+        share = cluster['size'] / total * 100 if total else 0
+        return f"「{cluster['label']}」（{cluster['size']}件、{share:.0f}%）: {cluster['summary']}"
+
+    async def _complete(
+        self,
+        prompt: str,
+        model: str,
+        max_tokens: int,
+        validate: Callable[[str], bool] = bool
+    ) -> str:
+        """キャッシュを確認してからLLMを呼び出す（validate を通った応答のみキャッシュ）"""
+        messages = [
+            {"role": "system", "content": "あなたは市民の意見を分析し、政策担当者向けに要点をまとめる専門家です。"},
+            {"role": "user", "content": prompt}
+        ]
+        cache_key = self.cache.make_key(model, messages)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        response = await self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=0.3,
+            max_tokens=max_tokens
+        )
+        content = (response.choices[0].message.content or "").strip()
+        if validate(content):
+            self.cache.set(cache_key, content)
+        return content
+
+    async def _reduce(self, notes: List[str], question: str, model: str) -> str:
+        """複数の要約を1つの中間要約にまとめる"""
+        notes_str = "\n".join([f"- {note}" for note in notes])
+        prompt = f"""質問: {question}
+
+以下は市民の意見のグループごとの要約です（件数と割合を含みます）。
+
+{notes_str}
+
+これらを、主要な論点とその件数・割合がわかるように、箇条書き5項目以内・300文字以内でまとめてください。
+少数でも重要な意見は残してください。日本語で出力してください。
+"""
+        return await self._complete(prompt, model, max_tokens=500)
+
+    async def _finalize(self, notes: List[str], question: str, model: str, max_takeaways: int) -> List[str]:
+        """最終的な要点を生成"""
+        notes_str = "\n".join([f"- {note}" for note in notes])
+        prompt = f"""質問: {question}
+
+以下は市民の意見の分析結果の要約です。
+
+{notes_str}
+
+政策担当者向けに、全体から読み取れる要点を{max_takeaways}個以内で作成してください。
+以下の形式でJSONとして出力してください：
+
+{{
+  "takeaways": ["要点1（60文字以内）", "要点2（60文字以内）"]
+}}
+
+注意事項：
+- 意見の多さだけでなく、対立する意見や少数だが重要な意見にも触れてください
+- 具体的に書き、一般論は避けてください
+- 日本語で出力してください
+"""
+        content = await self._complete(
+            prompt,
+            model,
+            max_tokens=100 * max_takeaways + 100,
+            validate=lambda c: bool(self._parse_takeaways(c))
+        )
+        return self._parse_takeaways(content)[:max_takeaways]
+
+    def _parse_takeaways(self, content: str) -> List[str]:
+        """要点の応答を解析"""
+        data = parse_json_response(content)
+        if not isinstance(data, dict) or not isinstance(data.get('takeaways'), list):
+            logger.error(f"Failed to parse takeaways as JSON: {content[:200]}...")
+            return []
+        return [str(t) for t in data['takeaways'] if str(t).strip()]
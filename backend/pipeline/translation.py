@@ -0,0 +1,184 @@
+import asyncio
+import copy
+import json
+import logging
+from typing import List, Dict, Any, Optional
+from openai import AsyncOpenAI
+from config import settings
+from pipeline.concurrency import GovernedClient
+from pipeline.cache import JsonCache
+from pipeline.llm_utils import (
+    ParseStats,
+    estimate_tokens,
+    pack_by_budget,
+    parse_or_repair,
+    response_payload,
+    structured_output_kwargs
+)
+
+logger = logging.getLogger(__name__)
+
+# 言語コード → プロンプトで使う言語名
+LANGUAGE_NAMES = {
+    "en": "英語",
+    "zh": "中国語（簡体字）",
+    "zh-TW": "中国語（繁体字）",
+    "ko": "韓国語",
+    "vi": "ベトナム語",
+    "pt": "ポルトガル語",
+    "es": "スペイン語",
+}
+
+TRANSLATION_FORMAT_HINT = '{"0": "訳文", "1": "訳文"}'
+
+class ReportTranslator:
+    """レポートを翻訳するクラス
+
+    レポート内の文字列（ラベル・要約・要点・議論の要約）を重複なく集め、
+    トークン予算に収まる単位でまとめて翻訳する。翻訳結果は言語ごとに
+    原文をキーとして永続キャッシュに保存するため、既存のレポートに言語を
+    追加した場合や再分析した場合は、未翻訳の文字列の分だけコストがかかる。
+    """
+
+    def __init__(self):
+        self.client = GovernedClient(AsyncOpenAI(api_key=settings.OPENAI_API_KEY))
+
+    def collect_strings(self, report: Dict[str, Any]) -> List[str]:
+        """翻訳対象の文字列を重複なく収集"""
+        strings = []
+        for cluster in report.get("clusters", []):
+            strings.append(cluster.get("label"))
+            strings.append(cluster.get("summary"))
+            strings.extend(arg.get("summary") for arg in cluster.get("arguments", []))
+        strings.extend(report.get("takeaways", []))
+        return list(dict.fromkeys(s for s in strings if isinstance(s, str) and s.strip()))
+
+    async def translate_report(
+        self,
+        report: Dict[str, Any],
+        languages: List[str],
+        model: str = "gpt-3.5-turbo",
+        parse_stats: Optional[ParseStats] = None
+    ) -> Dict[str, Dict[str, str]]:
+        """レポートの翻訳表を作成
+
+        parse_stats を渡すと、応答の解析結果（失敗・修復の件数）を "translation" として集計する。
+
+        Returns:
+            言語コード → {原文: 訳文}（翻訳に失敗した文字列は含めない）
+        """
+        strings = self.collect_strings(report)
+        translations = {}
+        for language in languages:
+            translations[language] = await self.translate_strings(strings, language, model, parse_stats)
+        return translations
+
+    async def translate_strings(
+        self,
+        strings: List[str],
+        language: str,
+        model: str,
+        parse_stats: Optional[ParseStats] = None
+    ) -> Dict[str, str]:
+        """文字列のリストを翻訳（キャッシュ済みのものはAPIを呼ばない）"""
+        cache = JsonCache(f"translation_{language}")
+        result = {}
+        missing = []
+        for text in strings:
+            cached = cache.get(cache.make_key(text))
+            if cached is not None:
+                result[text] = cached
+            else:
+                missing.append(text)
+
+        logger.info(
+            f"Translating {len(missing)} of {len(strings)} strings into {language} "
+            f"({len(strings) - len(missing)} cached)"
+        )
+        if not missing:
+            return result
+
+        batches = pack_by_budget(
+            missing,
+            [estimate_tokens(text) for text in missing],
+            settings.TRANSLATION_TOKEN_BUDGET,
+            settings.TRANSLATION_BATCH_SIZE
+        )
+        batch_results = await asyncio.gather(*[
+            self._translate_batch(batch, language, model, parse_stats) for batch in batches
+        ])
+
+        for translated in batch_results:
+            for source, target in translated.items():
+                cache.set(cache.make_key(source), target)
+                result[source] = target
+
+        return result
+
+    async def _translate_batch(
+        self,
+        texts: List[str],
+        language: str,
+        model: str,
+        parse_stats: Optional[ParseStats] = None
+    ) -> Dict[str, str]:
+        """1リクエスト分の文字列を翻訳"""
+        language_name = LANGUAGE_NAMES.get(language, language)
+        items = json.dumps({str(i): text for i, text in enumerate(texts)}, ensure_ascii=False, indent=0)
+        prompt = f"""以下のJSONの各値を{language_name}に翻訳してください。
+
+{items}
+
+キーはそのままにして、同じ形式のJSONで出力してください。
+注意事項：
+- 自治体の市民意見の分析レポートに使う文章です。自然で簡潔な表現にしてください
+- 訳文以外の説明は出力しないでください
+"""
+        try:
+            response = await self.client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": "あなたはプロの翻訳者です。必ずJSON形式で回答してください。"},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.0,
+                max_tokens=2 * sum(estimate_tokens(text) for text in texts) + 200,
+                **structured_output_kwargs(settings.STRUCTURED_OUTPUT)
+            )
+            data = await parse_or_repair(
+                self.client,
+                model,
+                response_payload(response),
+                lambda d: isinstance(d, dict),
+                TRANSLATION_FORMAT_HINT,
+                parse_stats,
+                "translation"
+            )
+            return self._format_translations(data, texts) if data else {}
+        except Exception as e:
+            logger.error(f"Error translating {len(texts)} strings into {language}: {e}")
+            return {}
+
+    def _format_translations(self, data: Dict[str, Any], texts: List[str]) -> Dict[str, str]:
+        """翻訳の応答を原文 → 訳文に変換（訳文のある文字列のみ返す）"""
+        result = {}
+        for i, text in enumerate(texts):
+            translated = data.get(str(i))
+            if isinstance(translated, str) and translated.strip():
+                result[text] = translated.strip()
+        return result
+
+
+def localize_report(report: Dict[str, Any], translations: Dict[str, str]) -> Dict[str, Any]:
+    """翻訳表を使ってレポートを指定言語に置き換える（未翻訳の文字列は原文のまま）"""
+    def tr(text):
+        return translations.get(text, text) if isinstance(text, str) else text
+
+    localized = copy.deepcopy({k: v for k, v in report.items() if k != "translations"})
+    for cluster in localized.get("clusters", []):
+        cluster["label"] = tr(cluster.get("label"))
+        cluster["summary"] = tr(cluster.get("summary"))
+        for arg in cluster.get("arguments", []):
+            arg["summary"] = tr(arg.get("summary"))
+    localized["takeaways"] = [tr(t) for t in localized.get("takeaways", [])]
+    return localized
@@ -1,7 +1,9 @@
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import pandas as pd
 import numpy as np
+from pipeline.clustering import group_by_cluster
+from pipeline.stats import vote_columns
 
 logger = logging.getLogger(__name__)
 
@@ -11,25 +13,39 @@ class VisualizationGenerator:
     async def generate_visualization(
         self,
         clusters: List[Dict[str, Any]],
-        embeddings: np.ndarray,
-        args_df: pd.DataFrame
+        args_df: pd.DataFrame,
+        labels: np.ndarray,
+        coords: np.ndarray,
+        takeaways: Optional[List[str]] = None,
+        cluster_stats: Optional[Dict[int, Dict[str, Any]]] = None
     ) -> Dict[str, Any]:
-        """可視化用のデータを生成"""
+        """可視化用のデータを生成
+
+        議論テーブルと labels / coords の配列から、シリアライズ直前にのみ
+        議論の辞書を組み立てる。takeaways が空の場合は簡易版の要点を使う。
+        cluster_stats を渡すと各クラスターに賛否の集計を付ける。
+        """
         logger.info("Generating visualization data")
         
+        labels = np.asarray(labels)
+        xs = np.asarray(coords[:, 0], dtype=np.float64)
+        ys = np.asarray(coords[:, 1], dtype=np.float64)
+        
+        # クラスターID → 座標の順で並べ替え（視覚的な一貫性のため）
+        order = np.lexsort((ys, xs, labels))
+        groups = group_by_cluster(labels, order)
+        
+        columns = {
+            name: args_df[name].to_numpy(dtype=object)
+            for name in ["argument_id", "comment_id", "argument", "summary"]
+        }
+        votes = vote_columns(args_df)
+        
         # クラスターデータを整形
         visualization_clusters = []
         
         for cluster in clusters:
-            # 各クラスターの議論を座標でソート（視覚的な一貫性のため）
-            try:
-                sorted_args = sorted(
-                    cluster['arguments'],
-                    key=lambda x: (x.get('x', 0), x.get('y', 0))
-                )
-            except Exception as e:
-                logger.error(f"Error sorting arguments: {e}")
-                sorted_args = cluster['arguments']
+            rows = groups.get(cluster['cluster_id'], np.empty(0, dtype=np.int64))
             
             viz_cluster = {
                 "cluster_id": cluster['cluster_id'],
@@ -40,22 +56,37 @@ class VisualizationGenerator:
                 "y": cluster['y'],
                 "arguments": [
                     {
-                        "argument_id": arg['argument_id'],
-                        "comment_id": arg['comment_id'],
-                        "argument": arg['argument'],
-                        "summary": arg['summary'],
-                        "x": arg.get('x', 0),
-                        "y": arg.get('y', 0)
+                        "argument_id": argument_id,
+                        "comment_id": comment_id,
+                        "argument": argument,
+                        "summary": summary,
+                        "x": x,
+                        "y": y,
+                        "agree": agree,
+                        "disagree": disagree
                     }
-                    for arg in sorted_args
+                    for argument_id, comment_id, argument, summary, x, y, agree, disagree in zip(
+                        columns["argument_id"][rows],
+                        columns["comment_id"][rows],
+                        columns["argument"][rows],
+                        columns["summary"][rows],
+                        xs[rows].tolist(),
+                        ys[rows].tolist(),
+                        votes["agree"][rows].tolist(),
+                        votes["disagree"][rows].tolist()
+                    )
                 ]
             }
             
+            if cluster_stats is not None:
+                viz_cluster["stats"] = cluster_stats.get(cluster['cluster_id'])
+            
             visualization_clusters.append(viz_cluster)
-        
-        # 全体的な要点を生成（簡易版）
-        takeaways = self._generate_takeaways(clusters)
-        
+
+        # LLMで要点を生成できなかった場合は簡易版を使う
+        if not takeaways:
+            takeaways = self._generate_takeaways(clusters)
+
         return {
             "clusters": visualization_clusters,
             "takeaways": takeaways,
@@ -65,7 +96,7 @@ class VisualizationGenerator:
                 "avg_cluster_size": float(np.mean([c['size'] for c in clusters]))
             }
         }
-    
+
     def _generate_takeaways(self, clusters: List[Dict[str, Any]]) -> List[str]:
         """全体的な要点を生成（簡易版）"""
         takeaways = []
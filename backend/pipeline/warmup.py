@@ -0,0 +1,73 @@
+import os
+import time
+import asyncio
+import logging
+import numpy as np
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def configure_numba() -> str:
+    """numba のキャッシュ先とスレッド層を設定
+
+    UMAP は numba のJITコンパイル済みカーネルを cache=True でディスクに保存する。
+    既定の保存先（site-packages 内の __pycache__）は書き込めない、またはコンテナの
+    再作成で消えるため、データディレクトリ配下に置いて再起動後も再利用する。
+
+    また、TBB / OpenMP のスレッド層はメインスレッド以外から UMAP を実行すると
+    プロセス終了時に停止するため、workqueue を使う。
+    numba の読み込み前に呼び出す必要がある（環境変数で指定済みの場合はそちらを優先）。
+    """
+    os.environ.setdefault("NUMBA_THREADING_LAYER", "workqueue")
+    cache_dir = os.environ.setdefault("NUMBA_CACHE_DIR", os.path.abspath(settings.NUMBA_CACHE_DIR))
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def warm_up_numeric() -> None:
+    """数値計算ライブラリを読み込み、小さなデータでJITコンパイルを済ませる
+
+    起動時にバックグラウンドのスレッドで実行する。最初の分析で発生していた
+    sklearn / umap の読み込みと numba のコンパイル待ちを先に済ませておく。
+    失敗しても分析時に改めて読み込まれるだけなので、ログに残して続行する。
+    """
+    start = time.perf_counter()
+    try:
+        from sklearn.cluster import KMeans
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        import umap
+
+        # クラスタリングと同じ型・経路でコンパイルする
+        # （TF-IDFの密行列は float64、UMAPの出力は float32。4096件以上では近傍探索に
+        #   NNDescent が使われ、大規模モードでは transform も使う）
+        rng = np.random.default_rng(0)
+        data = rng.random((4200, 16))
+        params = dict(n_neighbors=15, min_dist=0.1, metric="cosine", random_state=42, n_epochs=10)
+
+        reducer = umap.UMAP(n_components=8, **params)
+        embeddings = reducer.fit_transform(data)
+        reducer.transform(data[:100])
+
+        reducer_2d = umap.UMAP(n_components=2, **params).fit(embeddings)
+        reducer_2d.transform(embeddings[:100])
+
+        KMeans(n_clusters=2, n_init=1, random_state=42).fit(embeddings)
+        TfidfVectorizer().fit(["warm up"])
+
+        logger.info(f"Numeric warm-up finished in {time.perf_counter() - start:.1f}s")
+    except Exception as e:
+        logger.warning(f"Numeric warm-up failed: {e}")
+
+
+async def warm_up_in_background() -> None:
+    """クラスタリングと同じ cpu_slots の枠を確保してから、別スレッドで warm_up_numeric を実行
+
+    numba の workqueue スレッド層は複数のスレッドから同時に並列カーネルを実行すると
+    プロセスごと異常終了するため、ウォームアップ中に分析がクラスタリングに進んだ場合は
+    ウォームアップの完了を待たせる。
+    """
+    from pipeline.concurrency import cpu_slots
+
+    async with cpu_slots.slot():
+        await asyncio.to_thread(warm_up_numeric)
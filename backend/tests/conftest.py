@@ -0,0 +1,12 @@
+import os
+import sys
+
+# テストはバックエンドのディレクトリを基準に import する（uvicorn main:app と同じ）
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+
+from pipeline.warmup import configure_numba
+
+# テストの作業ディレクトリに移る前に numba のキャッシュ先を固定し、コンパイル結果を再利用する
+configure_numba()
@@ -0,0 +1,46 @@
+import os
+import asyncio
+
+import numpy as np
+import pytest
+
+from pipeline.clustering import ArgumentClusterer
+from pipeline.storage import ProjectArrays
+
+
+def _cluster(store, texts, num_clusters=8):
+    arguments = [{"argument": text} for text in texts]
+    return asyncio.run(ArgumentClusterer().cluster_arguments(arguments, store, num_clusters=num_clusters, large=True))
+
+
+def test_large_mode_with_few_arguments(tmp_path):
+    store = ProjectArrays(str(tmp_path))
+    texts = ["公園を広くしてほしい", "駅前に駐輪場がほしい", "図書館の開館時間を延長", "街灯を増やしてほしい", "ごみの分別を簡単に"]
+
+    arrays = _cluster(store, texts)
+
+    assert arrays["labels"].shape == (5,)
+    assert arrays["coords"].shape == (5, 2)
+    assert len(np.unique(arrays["labels"])) <= 2
+
+
+def test_large_mode_with_empty_vocabulary(tmp_path):
+    store = ProjectArrays(str(tmp_path))
+
+    arrays = _cluster(store, ["！？"] * 30, num_clusters=3)
+
+    assert arrays["embeddings"].shape[0] == 30
+    assert arrays["labels"].shape == (30,)
+
+
+def test_large_mode_removes_partial_files_on_error(tmp_path, monkeypatch):
+    store = ProjectArrays(str(tmp_path))
+
+    def fail(name, array):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(store, "commit", fail)
+    with pytest.raises(RuntimeError):
+        _cluster(store, [f"公園の遊具{i % 7}を新しく" for i in range(40)], num_clusters=3)
+
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
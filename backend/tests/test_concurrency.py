@@ -0,0 +1,166 @@
+import os
+import re
+import json
+import time
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from api.pipeline_runner import PipelineRunner
+from config import settings
+from pipeline.concurrency import llm_budget, _current_run
+
+EXAMPLE_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "example.csv")
+
+NUM_PROJECTS = 3
+NUM_COMMENTS = 120
+LLM_LIMIT = 4
+
+
+class FakeLLM:
+    """プロンプトから決定的な応答を返す chat.completions.create の代わり
+
+    同時リクエスト数（全体・分析ごと）の最大値を記録する。
+    """
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.per_run = {}
+        self.per_run_max = {}
+
+    def reset(self):
+        self.max_in_flight = 0
+        self.per_run_max = {}
+
+    async def create(self, **kwargs):
+        run_id = _current_run.get()
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self.per_run[run_id] = self.per_run.get(run_id, 0) + 1
+        self.per_run_max[run_id] = max(self.per_run_max.get(run_id, 0), self.per_run[run_id])
+        try:
+            await asyncio.sleep(0.005)
+            content = self._respond(kwargs["messages"][-1]["content"])
+            message = SimpleNamespace(content=content, tool_calls=None)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+        finally:
+            self.in_flight -= 1
+            self.per_run[run_id] -= 1
+
+    @staticmethod
+    def _respond(prompt: str) -> str:
+        if "コメント:" in prompt:
+            comment = prompt.split("コメント:")[1].strip().split("\n")[0]
+            data = {"arguments": [{"argument": comment[:60], "summary": comment[:10]}]}
+        elif "グループID:" in prompt:
+            ids = re.findall(r"グループID: (\d+)", prompt)
+            data = {"labels": [{"cluster_id": int(i), "label": f"テーマ{i}", "summary": "要約"} for i in ids]}
+        else:
+            data = {"takeaways": ["要点1", "要点2"], "label": "テーマ", "summary": "要約"}
+        return json.dumps(data, ensure_ascii=False)
+
+
+def _write_inputs(directory: str):
+    """プロジェクトごとに内容・件数の異なる入力CSVを作成"""
+    base = pd.read_csv(EXAMPLE_CSV)["comment-body"].tolist()
+    paths = []
+    for p in range(NUM_PROJECTS):
+        rows = [
+            {
+                "comment-id": i,
+                "comment-body": f"{base[(i * (p + 1)) % len(base)]}（{p}-{i}）",
+                "agree": i % 50,
+                "disagree": i % 7
+            }
+            for i in range(NUM_COMMENTS + 20 * p)
+        ]
+        path = os.path.join(directory, f"input{p}.csv")
+        pd.DataFrame(rows).to_csv(path, index=False)
+        paths.append(path)
+    return paths
+
+
+def _snapshot(project_id: str):
+    output_dir = os.path.join(settings.OUTPUT_DIR, project_id)
+    with open(os.path.join(output_dir, "result.json"), "r", encoding="utf-8") as f:
+        clusters = json.load(f)["clusters"]
+    return {
+        "args": pd.read_csv(os.path.join(output_dir, "args.csv")),
+        "labels": np.load(os.path.join(output_dir, "labels.npy")),
+        "coords": np.load(os.path.join(output_dir, "coords.npy")),
+        "clusters": [(c["cluster_id"], c["label"], c["size"]) for c in clusters]
+    }
+
+
+def _projects_db(project_ids):
+    return {pid: {"name": pid, "question": "公園について意見をください", "status": "analyzing"} for pid in project_ids}
+
+
+def test_concurrent_runs_match_isolated_runs(tmp_path, monkeypatch):
+    """複数のプロジェクトを同時に分析しても、1件ずつ分析した結果と一致し、LLMの同時リクエスト数が上限を超えない"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(llm_budget, "limit", LLM_LIMIT)
+    inputs = _write_inputs(str(tmp_path))
+
+    fake = FakeLLM()
+    runner = PipelineRunner()
+    for stage in ("extractor", "labeler", "takeaway_generator", "translator"):
+        monkeypatch.setattr(getattr(runner, stage).client.client.chat.completions, "create", fake.create)
+
+    config = {"num_clusters": 4, "extraction_workers": 6}
+
+    async def run_all():
+        # 1件ずつ分析
+        isolated = []
+        for p, path in enumerate(inputs):
+            project_id = f"isolated{p}"
+            db = _projects_db([project_id])
+            await runner.run_analysis(project_id, path, dict(config), db)
+            assert db[project_id]["analysis_status"] == "completed"
+            isolated.append(_snapshot(project_id))
+
+        # 同時に分析（イベントループが止まっていないかも計測する）
+        fake.reset()
+        project_ids = [f"concurrent{p}" for p in range(NUM_PROJECTS)]
+        db = _projects_db(project_ids)
+        lags = []
+
+        async def ticker():
+            while True:
+                start = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lags.append(time.perf_counter() - start - 0.01)
+
+        tick = asyncio.create_task(ticker())
+        await asyncio.gather(*[
+            runner.run_analysis(project_id, path, dict(config), db)
+            for project_id, path in zip(project_ids, inputs)
+        ])
+        tick.cancel()
+        assert all(db[pid]["analysis_status"] == "completed" for pid in project_ids)
+        return isolated, [_snapshot(pid) for pid in project_ids], lags
+
+    isolated, concurrent, lags = asyncio.run(run_all())
+
+    for expected, actual in zip(isolated, concurrent):
+        pd.testing.assert_frame_equal(expected["args"], actual["args"])
+        np.testing.assert_array_equal(expected["labels"], actual["labels"])
+        np.testing.assert_allclose(expected["coords"], actual["coords"])
+        assert expected["clusters"] == actual["clusters"]
+
+    assert 1 < fake.max_in_flight <= LLM_LIMIT
+    assert all(n <= LLM_LIMIT for n in fake.per_run_max.values())
+    # クラスタリング（CPU処理）は別スレッドで実行されるため、イベントループは長時間止まらない
+    assert max(lags) < 1.0
+
+
+def test_cpu_slots_are_clamped_with_workqueue_layer(monkeypatch):
+    from pipeline.concurrency import CpuSlots
+
+    monkeypatch.setenv("NUMBA_THREADING_LAYER", "workqueue")
+    assert CpuSlots(4).slots == 1
+    monkeypatch.setenv("NUMBA_THREADING_LAYER", "tbb")
+    assert CpuSlots(4).slots == 4
@@ -0,0 +1,26 @@
+import asyncio
+
+import pandas as pd
+
+from api.models import AnalysisConfig
+from pipeline.extraction import ArgumentExtractor
+
+
+def _comments(n: int) -> pd.DataFrame:
+    # 短いコメントはLLMを使わずにそのまま議論になる（local 経路）
+    return pd.DataFrame({"comment-id": range(n), "comment-body": [f"公園を広くして{i}" for i in range(n)]})
+
+
+def test_extraction_is_not_limited_by_default():
+    config = AnalysisConfig().model_dump()
+    extracted = asyncio.run(ArgumentExtractor().extract_arguments(
+        _comments(1500),
+        question="公園について",
+        limit=config["extraction_limit"]
+    ))
+    assert len(extracted) == 1500
+
+
+def test_extraction_limit_is_applied_when_set():
+    extracted = asyncio.run(ArgumentExtractor().extract_arguments(_comments(50), question="公園について", limit=20))
+    assert len(extracted) == 20
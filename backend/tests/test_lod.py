@@ -0,0 +1,123 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+from pipeline.lod import PointPyramid
+from pipeline.storage import ProjectArrays
+
+NUM_POINTS = 20000
+
+
+def _build(output_dir, max_level=6):
+    rng = np.random.default_rng(0)
+    coords = np.concatenate([
+        rng.normal(0, 1, (NUM_POINTS // 2, 2)),
+        rng.normal(5, 0.5, (NUM_POINTS // 2, 2))
+    ]).astype(np.float32)
+    labels = (np.arange(NUM_POINTS) >= NUM_POINTS // 2).astype(np.int32)
+    store = ProjectArrays(output_dir)
+    store.save(ProjectArrays.COORDS, coords)
+    store.save(ProjectArrays.LABELS, labels)
+    pd.DataFrame({"argument_id": [f"A{i}" for i in range(NUM_POINTS)]}).to_csv(
+        os.path.join(output_dir, "args.csv"), index=False
+    )
+    PointPyramid.build(output_dir, max_level=max_level)
+    return PointPyramid.load(output_dir), coords
+
+
+def _count(coords, bbox):
+    x, y = coords[:, 0], coords[:, 1]
+    return int(((x >= bbox[0]) & (x <= bbox[2]) & (y >= bbox[1]) & (y <= bbox[3])).sum())
+
+
+@pytest.fixture
+def pyramid(tmp_path):
+    return _build(str(tmp_path))
+
+
+def test_points_mode_when_few_points_in_bbox(pyramid):
+    index, coords = pyramid
+    bbox = (4.0, 4.0, 4.3, 4.3)
+
+    result = index.query(bbox, zoom=0, max_items=5000)
+
+    assert result["mode"] == "points"
+    assert result["total"] == len(result["points"]) == _count(coords, bbox)
+    assert all(bbox[0] <= p["x"] <= bbox[2] and bbox[1] <= p["y"] <= bbox[3] for p in result["points"])
+
+
+def test_bins_mode_when_many_points_in_bbox(pyramid):
+    index, coords = pyramid
+
+    result = index.query(None, zoom=3, max_items=5000)
+
+    assert result["mode"] == "bins"
+    assert result["total"] == NUM_POINTS
+    assert sum(b["count"] for b in result["bins"]) == NUM_POINTS
+
+
+def test_bins_total_is_clipped_to_bbox(pyramid):
+    index, coords = pyramid
+    # 粗いレベルのセルは bbox の外の点も含む
+    bbox = (-1.3, -1.1, 0.7, 0.9)
+
+    bins = index.query(bbox, zoom=0, max_items=100)
+    points = index.query(bbox, zoom=index.max_level + 1, max_items=NUM_POINTS)
+
+    assert bins["mode"] == "bins"
+    assert points["mode"] == "points"
+    assert bins["total"] == points["total"] == _count(coords, bbox)
+    assert sum(b["count"] for b in bins["bins"]) > bins["total"]
+
+
+def test_falls_back_to_coarser_level(pyramid):
+    index, _ = pyramid
+
+    result = index.query(None, zoom=index.max_level, max_items=20)
+
+    assert result["mode"] == "bins"
+    assert result["zoom"] < index.max_level
+    assert len(result["bins"]) <= 20
+
+
+def test_points_are_truncated_beyond_max_level(pyramid):
+    index, coords = pyramid
+
+    result = index.query(None, zoom=index.max_level + 1, max_items=100)
+
+    assert result["mode"] == "points"
+    assert result["truncated"]
+    assert result["total"] == NUM_POINTS
+    assert len(result["points"]) == 100
+
+
+def test_bbox_outside_extent(pyramid):
+    index, _ = pyramid
+
+    result = index.query((100.0, 100.0, 101.0, 101.0), zoom=0)
+
+    assert result["mode"] == "points"
+    assert result["total"] == 0
+
+
+def test_points_endpoint(tmp_path, monkeypatch):
+    import main
+    from config import settings
+
+    project_id = "lod-project"
+    output_dir = os.path.join(str(tmp_path), project_id)
+    os.makedirs(output_dir)
+    _, coords = _build(output_dir)
+    monkeypatch.setattr(settings, "OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setitem(main.projects_db, project_id, {"analysis_status": "completed"})
+    client = TestClient(main.app)
+
+    response = client.get(f"/api/projects/{project_id}/points", params={"bbox": "4,4,4.3,4.3"})
+    assert response.status_code == 200
+    assert response.json()["total"] == _count(coords, (4, 4, 4.3, 4.3))
+
+    assert client.get(f"/api/projects/{project_id}/points", params={"bbox": "1,2,3"}).status_code == 400
+    main.evict_project_caches(project_id)
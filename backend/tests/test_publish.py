@@ -0,0 +1,114 @@
+import os
+import gzip
+import json
+import asyncio
+
+import numpy as np
+
+from api.pipeline_runner import PipelineRunner
+from config import settings
+from pipeline.publish import ReportPublisher
+
+
+def _write_report(output_dir, takeaway="要点"):
+    report = {
+        "project_id": "p1",
+        "takeaways": [takeaway],
+        "clusters": [
+            {"cluster_id": 3, "label": "交通", "arguments": [
+                {"argument_id": "A1", "argument": "バスを増やす", "x": 0.5, "y": 1.5},
+                {"argument_id": "A2", "argument": "道路を広げる", "x": -1.0, "y": 2.0}
+            ]},
+            {"cluster_id": 7, "label": "公園", "arguments": [
+                {"argument_id": "A3", "argument": "公園を増やす", "x": 3.0, "y": -0.25}
+            ]}
+        ],
+        "metadata": {"created_at": "2026-01-01T00:00:00"}
+    }
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "result.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False)
+
+
+def _manifest(public_dir, latest):
+    with gzip.open(os.path.join(public_dir, "p1", latest["hash"], ReportPublisher.MANIFEST + ".gz")) as f:
+        return json.load(f)
+
+
+def _bundles(public_dir):
+    return {name for name in os.listdir(os.path.join(public_dir, "p1")) if not name.endswith(".json")}
+
+
+def test_unchanged_report_reuses_bundle(tmp_path):
+    output_dir, public_dir = str(tmp_path / "output"), str(tmp_path / "public")
+    _write_report(output_dir)
+    publisher = ReportPublisher(public_dir)
+
+    first = publisher.publish("p1", output_dir)
+    manifest_path = os.path.join(public_dir, "p1", first["hash"], ReportPublisher.MANIFEST + ".gz")
+    mtime = os.path.getmtime(manifest_path)
+    second = publisher.publish("p1", output_dir)
+
+    assert first["created"] and not second["created"]
+    assert first["hash"] == second["hash"]
+    assert os.path.getmtime(manifest_path) == mtime
+    assert publisher.latest("p1")["manifest"] == f"/share/p1/{first['hash']}/manifest.json"
+
+
+def test_prune_keeps_current_and_previous_bundle(tmp_path):
+    output_dir, public_dir = str(tmp_path / "output"), str(tmp_path / "public")
+    publisher = ReportPublisher(public_dir)
+
+    hashes = []
+    for takeaway in ("1", "2", "3"):
+        _write_report(output_dir, takeaway)
+        hashes.append(publisher.publish("p1", output_dir)["hash"])
+
+    assert len(set(hashes)) == 3
+    assert _bundles(public_dir) == {hashes[1], hashes[2]}
+    assert publisher.latest("p1")["hash"] == hashes[2]
+
+
+def test_point_arrays_and_ranges_round_trip(tmp_path):
+    output_dir, public_dir = str(tmp_path / "output"), str(tmp_path / "public")
+    _write_report(output_dir)
+    latest = ReportPublisher(public_dir).publish("p1", output_dir)
+    manifest = _manifest(public_dir, latest)
+    bundle_dir = os.path.join(public_dir, "p1", latest["hash"])
+
+    points = manifest["points"]
+    coords = np.fromfile(os.path.join(bundle_dir, points["coords"]["path"]), dtype="<f4").reshape(points["coords"]["shape"])
+    clusters = np.fromfile(os.path.join(bundle_dir, points["clusters"]["path"]), dtype="<i4")
+
+    np.testing.assert_array_equal(coords, [[0.5, 1.5], [-1.0, 2.0], [3.0, -0.25]])
+    np.testing.assert_array_equal(clusters, [3, 3, 7])
+    assert points["ranges"] == [
+        {"cluster_id": 3, "offset": 0, "count": 2},
+        {"cluster_id": 7, "offset": 2, "count": 1}
+    ]
+    assert points["extent"] == [-1.0, -0.25, 3.0, 2.0]
+    for cluster_range in points["ranges"]:
+        with gzip.open(os.path.join(bundle_dir, manifest["locales"]["default"]["clusters"][str(cluster_range["cluster_id"])] + ".gz")) as f:
+            assert len(json.load(f)["arguments"]) == cluster_range["count"]
+
+
+def test_publish_failure_does_not_fail_translation(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, "PUBLISH_ON_COMPLETE", True)
+    _write_report(os.path.join(settings.OUTPUT_DIR, "p1"))
+    project = {"id": "p1", "analysis_status": "completed", "share_url": None}
+    runner = PipelineRunner()
+
+    async def translate_report(report, languages, model, parse_stats=None):
+        return {language: {"要点": "takeaway"} for language in languages}
+
+    def publish(project_id, output_dir):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(runner.translator, "translate_report", translate_report)
+    monkeypatch.setattr(runner.publisher, "publish", publish)
+
+    asyncio.run(runner.add_translations("p1", ["en"], {}, project))
+
+    assert project["translation_status"] == "completed"
+    assert project["share_url"] is None
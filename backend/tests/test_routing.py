@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+from pipeline.routing import is_trivial_comment, route_comment
+
+
+@pytest.mark.parametrize("text", [
+    "特になし",
+    "以上です",
+    "意見は特にありません",
+    "ありがとうございます",
+    "よろしくお願いします。",
+    "ありがとうございました。よろしくお願いいたします。",
+    "お疲れ様です",
+    "Thank you!",
+    "・・・",
+])
+def test_contentless_comments(text):
+    assert is_trivial_comment(text)
+
+
+@pytest.mark.parametrize("text", [
+    "公園を広くして",
+    "ありがとう、公園は良い",
+    "バスを増やしてほしい",
+    "無いと困る",
+])
+def test_comments_with_content(text):
+    assert not is_trivial_comment(text)
+
+
+def _route(text, strong_model=None):
+    return route_comment(
+        text,
+        fast_model="fast",
+        strong_model=strong_model,
+        local_max_chars=20,
+        strong_min_chars=400,
+        strong_min_sentences=8,
+        max_tokens_cap=1500
+    )
+
+
+def test_greetings_are_skipped_instead_of_kept_verbatim():
+    assert _route("よろしくお願いします")["route"] == "skip"
+    assert _route("駐輪場がほしい")["route"] == "local"
+
+
+def test_long_comments_use_project_model_without_strong_model():
+    text = "公園の遊具が古くなっています。" * 30
+    assert _route(text)["model"] == "fast"
+    assert _route(text, strong_model="strong")["model"] == "strong"
+
+
+def test_long_adversarial_comment_is_checked_quickly():
+    # 一致しそうで最後に一致しない長い入力でも、照合がバックトラックで遅くならない
+    text = "なし以上です" * 40 + "駅"
+    start = time.perf_counter()
+    assert not is_trivial_comment(text)
+    assert not is_trivial_comment(("なし以上です" * 5 + "駅")[:40])
+    assert time.perf_counter() - start < 0.1
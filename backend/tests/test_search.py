@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+from pipeline.search import ProjectSearchIndex
+from pipeline.storage import ProjectArrays
+
+TEXTS = [
+    "夜道の街灯が暗いので増やしてほしい",
+    "街灯をLEDに交換して明るくしてほしい",
+    "駐車場が足りない",
+    "トイレを清潔に保ってほしい",
+    "公園の遊具を新しくしてほしい",
+    "ベンチが少ない",
+]
+
+
+def _build(tmp_path, embeddings=None):
+    output_dir = str(tmp_path)
+    store = ProjectArrays(output_dir)
+    rng = np.random.default_rng(0)
+    if embeddings is None:
+        embeddings = rng.random((len(TEXTS), 8)).astype(np.float32)
+    store.save(ProjectArrays.EMBEDDINGS, embeddings)
+    store.save(ProjectArrays.LABELS, np.zeros(len(TEXTS), dtype=np.int32))
+    pd.DataFrame({
+        "argument_id": [f"A{i}" for i in range(len(TEXTS))],
+        "comment_id": [str(i) for i in range(len(TEXTS))],
+        "argument": TEXTS,
+        "summary": TEXTS,
+    }).to_csv(tmp_path / "args.csv", index=False)
+    ProjectSearchIndex.build(output_dir, TEXTS, brute_force_limit=1000)
+    return ProjectSearchIndex.load(output_dir)
+
+
+def test_common_kana_alone_does_not_match(tmp_path):
+    index = _build(tmp_path)
+    hits = index.search("暗い街灯", k=10)
+    assert [h["argument_id"] for h in hits] == ["A0", "A1"]
+    assert all(h["score"] < 1.0 for h in hits)
+
+
+def test_unseen_query_terms_lower_the_score(tmp_path):
+    index = _build(tmp_path)
+    full = index.search("駐車場", k=1)[0]
+    partial = index.search("駐車場の料金", k=1)[0]
+    assert full["argument_id"] == partial["argument_id"] == "A2"
+    assert partial["score"] < full["score"]
+
+
+def test_expand_merges_vector_neighbours_by_score(tmp_path):
+    # A0 と A4 は埋め込みが近く、A4 は「街灯」を含まない
+    embeddings = np.eye(len(TEXTS), dtype=np.float32)
+    embeddings[4] = embeddings[0] * 0.9 + embeddings[4] * 0.1
+    index = _build(tmp_path, embeddings)
+
+    plain = [h["argument_id"] for h in index.search("街灯", k=10)]
+    expanded = [h["argument_id"] for h in index.search("街灯", k=10, expand=True)]
+    assert "A4" not in plain
+    assert "A4" in expanded
+    assert expanded.index("A4") > expanded.index("A0")
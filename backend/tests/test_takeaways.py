@@ -0,0 +1,44 @@
+import json
+import asyncio
+from types import SimpleNamespace
+
+from pipeline.takeaways import TakeawayGenerator
+
+
+def _generator(tmp_path, monkeypatch, reduced_note: str):
+    monkeypatch.chdir(tmp_path)
+    generator = TakeawayGenerator()
+    calls = []
+
+    async def create(**kwargs):
+        prompt = kwargs["messages"][-1]["content"]
+        calls.append(prompt)
+        content = json.dumps({"takeaways": ["要点"]}, ensure_ascii=False) if '"takeaways"' in prompt else reduced_note
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    monkeypatch.setattr(generator.client.chat.completions, "_completions", SimpleNamespace(create=create))
+    return generator, calls
+
+
+def test_reduce_terminates_when_budget_fits_one_note(tmp_path, monkeypatch):
+    """予算が要約1件分しかなくても、まとめ処理は件数を減らしながら終わる"""
+    # まとめた要約は毎回長く、予算に2件入らない
+    generator, calls = _generator(tmp_path, monkeypatch, "- 長い中間要約" * 80)
+    clusters = [{"label": f"テーマ{i}", "summary": "要約" * 20, "size": i + 1} for i in range(100)]
+
+    takeaways = asyncio.run(generator.generate_takeaways(clusters, "質問", token_budget=600))
+
+    assert takeaways == ["要点"]
+    # 2件ずつまとめるため、まとめ処理は高々 100 + 50 + 25 + ... 回
+    assert len(calls) < 200
+
+
+def test_reduce_levels_are_capped(tmp_path, monkeypatch):
+    generator, calls = _generator(tmp_path, monkeypatch, "- 中間要約" * 80)
+    monkeypatch.setattr(TakeawayGenerator, "MAX_REDUCE_LEVELS", 1)
+    clusters = [{"label": f"テーマ{i}", "summary": "要約" * 200, "size": i + 1} for i in range(8)]
+
+    asyncio.run(generator.generate_takeaways(clusters, "質問", token_budget=100))
+
+    # 1段目のまとめ（4回）と最終的な要点の生成（1回）のみ
+    assert len(calls) == 5
@@ -0,0 +1,110 @@
+import os
+import json
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from api.pipeline_runner import PipelineRunner
+from config import settings
+from pipeline.llm_utils import ParseStats, parse_or_repair
+from pipeline.translation import ReportTranslator
+
+
+def _response(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content, tool_calls=None))])
+
+
+class FakeCompletions:
+    """1回目は壊れた応答、修復プロンプトには正しいJSONを返す"""
+
+    def __init__(self, repaired):
+        self.repaired = repaired
+        self.calls = []
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        if len(self.calls) == 1:
+            return _response("訳: 0 は Park, 1 は Bus です")
+        return _response(json.dumps(self.repaired))
+
+
+def test_translation_repairs_malformed_response(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    translator = ReportTranslator()
+    fake = FakeCompletions({"0": "Park", "1": "Bus"})
+    monkeypatch.setattr(translator.client.chat, "completions", SimpleNamespace(create=fake.create))
+    stats = ParseStats()
+
+    result = asyncio.run(translator.translate_strings(["公園", "バス"], "en", "model", stats))
+
+    assert result == {"公園": "Park", "バス": "Bus"}
+    assert len(fake.calls) == 2
+    assert stats.as_dict()["translation"]["recovered"] == 1
+
+
+def test_repair_request_follows_structured_output_mode():
+    async def repair(mode):
+        fake = FakeCompletions({"ok": True})
+        fake.calls.append({})  # 1回目の応答は使わない
+        client = SimpleNamespace(chat=SimpleNamespace(completions=fake))
+        data = await parse_or_repair(client, "model", "not json", lambda d: isinstance(d, dict), "{}", mode=mode)
+        return data, fake.calls[-1]
+
+    data, request = asyncio.run(repair("off"))
+    assert data == {"ok": True}
+    assert "response_format" not in request
+
+    _, request = asyncio.run(repair("json"))
+    assert request["response_format"] == {"type": "json_object"}
+
+
+def _completed_project(tmp_path, monkeypatch, project_id="p1"):
+    monkeypatch.chdir(tmp_path)
+    output_dir = os.path.join(settings.OUTPUT_DIR, project_id)
+    os.makedirs(output_dir)
+    report = {"project_id": project_id, "clusters": [], "takeaways": ["要点"], "metadata": {}}
+    with open(os.path.join(output_dir, "result.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False)
+    return output_dir, {"id": project_id, "analysis_status": "completed"}
+
+
+def test_concurrent_translations_are_merged(tmp_path, monkeypatch):
+    output_dir, project = _completed_project(tmp_path, monkeypatch)
+    runner = PipelineRunner()
+
+    async def translate_report(report, languages, model, parse_stats=None):
+        # 後から始めた翻訳の方が先に終わる
+        await asyncio.sleep(0.05 if languages == ["en"] else 0.01)
+        return {language: {"要点": f"takeaway-{language}"} for language in languages}
+
+    monkeypatch.setattr(runner.translator, "translate_report", translate_report)
+
+    async def run():
+        await asyncio.gather(
+            runner.add_translations("p1", ["en"], {}, project),
+            runner.add_translations("p1", ["ko"], {}, project)
+        )
+
+    asyncio.run(run())
+
+    with open(os.path.join(output_dir, "result.json"), "r", encoding="utf-8") as f:
+        translations = json.load(f)["translations"]
+    assert set(translations) == {"en", "ko"}
+    assert project["translation_status"] == "completed"
+
+
+def test_translation_failure_is_recorded_on_project(tmp_path, monkeypatch):
+    _, project = _completed_project(tmp_path, monkeypatch)
+    runner = PipelineRunner()
+
+    async def translate_report(report, languages, model, parse_stats=None):
+        raise RuntimeError("quota exceeded")
+
+    monkeypatch.setattr(runner.translator, "translate_report", translate_report)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(runner.add_translations("p1", ["en"], {}, project))
+
+    assert project["translation_status"] == "failed"
+    assert "quota exceeded" in project["error_message"]